@@ -11,12 +11,39 @@ class Config(object):
     UPDATES_CHANNEL = os.environ.get("UPDATES_CHANNEL", None)  # Allow None for optional channel
     LOG_CHANNEL = os.environ.get("LOG_CHANNEL", None)  # Allow None for optional channel
     DOWN_PATH = os.environ.get("DOWN_PATH", "./downloads")
+    CACHE_PATH = os.environ.get("CACHE_PATH", "./cache")  # Persistent caches, kept outside DOWN_PATH
+    DOWNLOAD_CACHE_SIZE = int(os.environ.get("DOWNLOAD_CACHE_SIZE", 10 * 1024 ** 3))  # Bytes of downloaded clips kept for reuse
+    DISK_HEADROOM = int(os.environ.get("DISK_HEADROOM", 512 * 1024 ** 2))  # Bytes of free disk never reserved for jobs
+    SCRATCH_MAX_AGE = int(os.environ.get("SCRATCH_MAX_AGE", 6 * 3600))  # Seconds before idle DOWN_PATH entries are removed
+    SCRATCH_HIGH_WATER = float(os.environ.get("SCRATCH_HIGH_WATER", 90))  # Disk usage percent above which idle entries are removed early
+    SCRATCH_SCAN_INTERVAL = int(os.environ.get("SCRATCH_SCAN_INTERVAL", 600))  # Seconds between DOWN_PATH scans
+    CHECKPOINT_INTERVAL = int(os.environ.get("CHECKPOINT_INTERVAL", 10))  # Seconds between saves of queues and job stages
+    DRAIN_TIMEOUT = int(os.environ.get("DRAIN_TIMEOUT", 20))  # Seconds running merges get to finish on shutdown
     TIME_GAP = int(os.environ.get("TIME_GAP", 5))
     MAX_VIDEOS = int(os.environ.get("MAX_VIDEOS", 5))
+    DOWNLOAD_CONCURRENCY = int(os.environ.get("DOWNLOAD_CONCURRENCY", 3))  # Queued videos downloaded at once
+    TG_MAX_FILE_SIZE = 2097152000  # Largest file the bot can upload to Telegram
+    FIT_TO_TELEGRAM = os.environ.get("FIT_TO_TELEGRAM", "True").lower() == "true"  # Encode oversized merges to fit TG_MAX_FILE_SIZE
+    FFMPEG_SLOTS = int(os.environ.get("FFMPEG_SLOTS", max(1, (os.cpu_count() or 2) // 2)))  # FFmpeg processes allowed to run at once
+    FFMPEG_CORES = int(os.environ.get("FFMPEG_CORES", 0))  # Cores shared by FFmpeg jobs, 0 to detect
+    SAMPLE_ACCURATE = os.environ.get("SAMPLE_ACCURATE", "False").lower() == "true"  # Re-encode sample clips for a frame-exact start
+    PROBE_CACHE_SIZE = int(os.environ.get("PROBE_CACHE_SIZE", 512))  # Cached ffprobe results (LRU)
+    PROBE_CACHE_PERSIST = os.environ.get("PROBE_CACHE_PERSIST", "True").lower() == "true"  # Keep probe results across restarts
+    PROBE_CACHE_SAVE_INTERVAL = int(os.environ.get("PROBE_CACHE_SAVE_INTERVAL", 60))  # Seconds between saves of new probe results
+    PROBE_CONCURRENCY = int(os.environ.get("PROBE_CONCURRENCY", 4))  # Parallel ffprobe runs per merge
+    NORMALIZE_WORKERS = int(os.environ.get("NORMALIZE_WORKERS", max(1, (os.cpu_count() or 2) // 2)))  # Parallel clip normalizations per merge
+    STREAM_INPUTS = os.environ.get("STREAM_INPUTS", "False").lower() == "true"  # Pipe queued videos into FFmpeg instead of downloading them first
+    OUTPUT_PROFILE = os.environ.get("OUTPUT_PROFILE", "fragmented").lower()  # MP4 layout: fragmented, faststart or plain
     STREAMTAPE_API_USERNAME = os.environ.get("STREAMTAPE_API_USERNAME", "")
     STREAMTAPE_API_PASS = os.environ.get("STREAMTAPE_API_PASS", "")
     MONGODB_URI = os.environ.get("MONGODB_URI", "")
+    DATABASE_BACKEND = os.environ.get("DATABASE_BACKEND", "mongodb").lower()  # mongodb, or sqlite for a local file
+    SQLITE_PATH = os.environ.get("SQLITE_PATH", "")  # SQLite file, defaults to <CACHE_PATH>/<SESSION_NAME>.db
+    SETTINGS_CACHE_SIZE = int(os.environ.get("SETTINGS_CACHE_SIZE", 1024))  # Users whose settings are cached in memory
+    SETTINGS_CACHE_TTL = int(os.environ.get("SETTINGS_CACHE_TTL", 300))  # Seconds a cached settings entry stays valid
     BROADCAST_AS_COPY = bool(os.environ.get("BROADCAST_AS_COPY", False))
+    BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", 25))  # Broadcast messages sent per second, across all senders
+    BROADCAST_CONCURRENCY = max(1, int(os.environ.get("BROADCAST_CONCURRENCY", 10)))  # Broadcast messages in flight at once
     BOT_OWNER = int(os.environ.get("BOT_OWNER", 5059280908))
 
     START_TEXT = """
@@ -32,4 +59,11 @@ Done: {1}
 Total: {2}
 Speed: {3}/s
 ETA: {4}
-"""
\ No newline at end of file
+"""
+    FFMPEG_PROGRESS = """
+Percentage: {0}%
+Done: {1}
+Total: {2}
+Speed: {3}x
+ETA: {4}
+"""
@@ -11,33 +11,72 @@ import traceback
 from configs import Config
 from helpers.database.access_db import db
 from pyrogram.types import Message
+from pyrogram.enums import ParseMode
 from pyrogram.errors import FloodWait, InputUserDeactivated, UserIsBlocked, PeerIdInvalid
 
 broadcast_ids = {}
 
+# Dead users collected before they are deleted in one query
+DELETE_BATCH_SIZE = 500
 
-async def send_msg(user_id: int, message: Message):
-    try:
-        if Config.BROADCAST_AS_COPY is False:
-            await message.forward(chat_id=user_id)
-        else:
-            await message.copy(chat_id=user_id)
-        return 200, None
-    except FloodWait as e:
-        await asyncio.sleep(e.value)  # Updated to e.value for Pyrogram 2.x
-        return await send_msg(user_id, message)  # Recursive call with await
-    except InputUserDeactivated:
-        return 400, f"{user_id}: Deactivated\n"
-    except UserIsBlocked:
-        return 400, f"{user_id}: Blocked the bot\n"
-    except PeerIdInvalid:
-        return 400, f"{user_id}: User ID invalid\n"
-    except Exception as e:
-        return 500, f"{user_id}: {traceback.format_exc()}\n"
+
+class RateLimiter:
+    """
+    Token bucket shared by all broadcast senders.
+
+    Allows `rate` sends per second with bursts of up to `capacity`. A
+    FloodWait seen by any sender pauses every sender until it is over.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+async def send_msg(user_id: int, message: Message, limiter: RateLimiter):
+    while True:
+        await limiter.acquire()
+        try:
+            if Config.BROADCAST_AS_COPY is False:
+                await message.forward(chat_id=user_id)
+            else:
+                await message.copy(chat_id=user_id)
+            return 200, None
+        except FloodWait as e:
+            limiter.pause(e.value)
+        except InputUserDeactivated:
+            return 400, f"{user_id}: Deactivated\n"
+        except UserIsBlocked:
+            return 400, f"{user_id}: Blocked the bot\n"
+        except PeerIdInvalid:
+            return 400, f"{user_id}: User ID invalid\n"
+        except Exception as e:
+            return 500, f"{user_id}: {traceback.format_exc()}\n"
 
 
 async def broadcast_handler(m: Message):
-    all_users = await db.get_all_users()
     broadcast_msg = m.reply_to_message
     if not broadcast_msg:
         await m.reply_text("Please reply to a message to broadcast!", quote=True)
@@ -51,37 +90,57 @@ async def broadcast_handler(m: Message):
     )
     start_time = time.time()
     total_users = await db.total_users_count()
-    done = 0
-    failed = 0
-    success = 0
-    broadcast_ids[broadcast_id] = {
+    stats = {
         "total": total_users,
-        "current": done,
-        "failed": failed,
-        "success": success
+        "current": 0,
+        "failed": 0,
+        "success": 0
     }
+    broadcast_ids[broadcast_id] = stats
+    limiter = RateLimiter(Config.BROADCAST_RATE, Config.BROADCAST_CONCURRENCY)
+    user_queue = asyncio.Queue(maxsize=Config.BROADCAST_CONCURRENCY * 2)
+    dead_users = []
+
+    async def sender():
+        while True:
+            user_id = await user_queue.get()
+            try:
+                sts, msg = await send_msg(user_id=user_id, message=broadcast_msg, limiter=limiter)
+                if msg is not None:
+                    await broadcast_log_file.write(msg)
+                if sts == 200:
+                    stats["success"] += 1
+                else:
+                    stats["failed"] += 1
+                if sts == 400:
+                    dead_users.append(user_id)
+                    if len(dead_users) >= DELETE_BATCH_SIZE:
+                        batch = dead_users[:]
+                        dead_users.clear()
+                        try:
+                            await db.delete_users(batch)
+                        except Exception:
+                            await broadcast_log_file.write(f"Deleting {len(batch)} users failed: {traceback.format_exc()}\n")
+                stats["current"] += 1
+            finally:
+                user_queue.task_done()
+
+    # Failures are written as they happen, so memory does not grow with their number
     async with aiofiles.open("broadcast.txt", "w") as broadcast_log_file:
-        async for user in all_users:
-            if broadcast_ids.get(broadcast_id) is None:
-                break
-            sts, msg = await send_msg(
-                user_id=int(user["id"]),
-                message=broadcast_msg
-            )
-            if msg is not None:
-                await broadcast_log_file.write(msg)
-            if sts == 200:
-                success += 1
-            else:
-                failed += 1
-            if sts == 400:
-                await db.delete_user(user["id"])
-            done += 1
-            broadcast_ids[broadcast_id].update({
-                "current": done,
-                "failed": failed,
-                "success": success
-            })
+        senders = [asyncio.create_task(sender()) for _ in range(Config.BROADCAST_CONCURRENCY)]
+        try:
+            async for user_id in db.iter_user_ids():
+                # Cancelled broadcasts are removed from broadcast_ids
+                if broadcast_ids.get(broadcast_id) is None:
+                    break
+                await user_queue.put(int(user_id))
+            await user_queue.join()
+        finally:
+            for task in senders:
+                task.cancel()
+            await asyncio.gather(*senders, return_exceptions=True)
+    await db.delete_users(dead_users)
+    done, success, failed = stats["current"], stats["success"], stats["failed"]
     if broadcast_id in broadcast_ids:
         del broadcast_ids[broadcast_id]
     completed_in = datetime.timedelta(seconds=int(time.time() - start_time))
@@ -1,6 +1,20 @@
 # (c) @AbirHasan2005
 
+import os
 from configs import Config
 from helpers.database.database import Database
+from helpers.database.sqlite_database import SQLiteDatabase
 
-db = Database(Config.MONGODB_URI, Config.SESSION_NAME)
+if Config.DATABASE_BACKEND == "sqlite":
+    db = SQLiteDatabase(
+        Config.SQLITE_PATH or os.path.join(Config.CACHE_PATH, f"{Config.SESSION_NAME}.db"),
+        settings_cache_size=Config.SETTINGS_CACHE_SIZE,
+        settings_ttl=Config.SETTINGS_CACHE_TTL
+    )
+else:
+    db = Database(
+        Config.MONGODB_URI,
+        Config.SESSION_NAME,
+        settings_cache_size=Config.SETTINGS_CACHE_SIZE,
+        settings_ttl=Config.SETTINGS_CACHE_TTL
+    )
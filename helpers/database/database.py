@@ -1,15 +1,36 @@
 # (c) @AbirHasan2005
 
+import time
 import datetime
 import motor.motor_asyncio
+from pymongo.errors import DuplicateKeyError
+from collections import OrderedDict
+
+# Per-user settings and their defaults for users stored without them
+SETTINGS_DEFAULTS = dict(
+    upload_as_doc=False,
+    thumbnail=None,
+    generate_ss=False,
+    generate_sample_video=False
+)
 
 
 class Database:
 
-    def __init__(self, uri, database_name):
+    def __init__(self, uri, database_name, settings_cache_size=1024, settings_ttl=300):
         self._client = motor.motor_asyncio.AsyncIOMotorClient(uri)
         self.db = self._client[database_name]
         self.col = self.db.users
+        self.merges = self.db.merges
+        self._init_caches(settings_cache_size, settings_ttl)
+
+    def _init_caches(self, settings_cache_size, settings_ttl):
+        # user id -> (expiry, settings); LRU-bounded, entries expire after settings_ttl seconds
+        self._settings = OrderedDict()
+        self.settings_cache_size = max(1, settings_cache_size)
+        self.settings_ttl = settings_ttl
+        # Ids known to be stored, so repeat messages skip the database
+        self._known_users = set()
 
     def new_user(self, id):
         return dict(
@@ -21,12 +42,52 @@ class Database:
             generate_sample_video=False
         )
 
+    async def flush(self):
+        """Commit writes still held back by the backend; Mongo writes are immediate."""
+        pass
+
+    async def ensure_indexes(self):
+        """Create the indexes the queries rely on; run once at startup."""
+        try:
+            await self.col.create_index('id', unique=True)
+        except DuplicateKeyError:
+            # Left over from the old check-then-insert registration
+            await self._drop_duplicate_users()
+            await self.col.create_index('id', unique=True)
+        await self.merges.create_index('key', unique=True)
+
+    async def _drop_duplicate_users(self):
+        duplicates = self.col.aggregate([
+            {'$group': {'_id': '$id', 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+            {'$match': {'count': {'$gt': 1}}}
+        ])
+        async for group in duplicates:
+            await self.col.delete_many({'_id': {'$in': group['ids'][1:]}})
+
+    async def warm_known_users(self):
+        """Load the ids of all stored users into the known-user set."""
+        async for user in self.col.find({}, {'id': 1, '_id': 0}):
+            self._known_users.add(user['id'])
+
     async def add_user(self, id):
-        user = self.new_user(id)
-        await self.col.insert_one(user)
+        """Register a user if unknown. Returns True if the user was new."""
+        id = int(id)
+        if id in self._known_users:
+            return False
+        result = await self.col.update_one(
+            {'id': id},
+            {'$setOnInsert': self.new_user(id)},
+            upsert=True
+        )
+        self._known_users.add(id)
+        return result.upserted_id is not None
 
     async def is_user_exist(self, id):
-        user = await self.col.find_one({'id': int(id)})
+        if int(id) in self._known_users:
+            return True
+        user = await self.col.find_one({'id': int(id)}, {'_id': 1})
+        if user:
+            self._known_users.add(int(id))
         return True if user else False
 
     async def total_users_count(self):
@@ -37,33 +98,91 @@ class Database:
         all_users = self.col.find({})
         return all_users
 
+    async def iter_user_ids(self, batch_size=1000):
+        """Yield the ids of all users, fetched in batches with only the id field."""
+        async for user in self.col.find({}, {'id': 1, '_id': 0}).batch_size(batch_size):
+            yield user['id']
+
+    async def delete_users(self, user_ids):
+        """Delete many users with one query."""
+        user_ids = [int(user_id) for user_id in user_ids]
+        if not user_ids:
+            return
+        await self.col.delete_many({'id': {'$in': user_ids}})
+        for user_id in user_ids:
+            self._settings.pop(user_id, None)
+            self._known_users.discard(user_id)
+
     async def delete_user(self, user_id):
         await self.col.delete_many({'id': int(user_id)})
+        self._settings.pop(int(user_id), None)
+        self._known_users.discard(int(user_id))
+
+    async def _load_settings(self, id):
+        projection = {key: 1 for key in SETTINGS_DEFAULTS}
+        projection['_id'] = 0
+        user = await self.col.find_one({'id': id}, projection) or {}
+        return {key: user.get(key, default) for key, default in SETTINGS_DEFAULTS.items()}
+
+    async def _store_setting(self, id, key, value):
+        await self.col.update_one({'id': id}, {'$set': {key: value}})
+
+    async def get_settings(self, id):
+        """All settings of a user, from the cache or with one projected query."""
+        id = int(id)
+        cached = self._settings.get(id)
+        if cached is not None and cached[0] > time.monotonic():
+            self._settings.move_to_end(id)
+            return dict(cached[1])
+        settings = await self._load_settings(id)
+        self._settings[id] = (time.monotonic() + self.settings_ttl, settings)
+        self._settings.move_to_end(id)
+        while len(self._settings) > self.settings_cache_size:
+            self._settings.popitem(last=False)
+        return dict(settings)
+
+    async def set_setting(self, id, key, value):
+        """Write a setting through to the database and the cache."""
+        id = int(id)
+        await self._store_setting(id, key, value)
+        cached = self._settings.get(id)
+        if cached is not None:
+            cached[1][key] = value
 
     async def set_upload_as_doc(self, id, upload_as_doc):
-        await self.col.update_one({'id': id}, {'$set': {'upload_as_doc': upload_as_doc}})
+        await self.set_setting(id, 'upload_as_doc', upload_as_doc)
 
     async def get_upload_as_doc(self, id):
-        user = await self.col.find_one({'id': int(id)})
-        return user.get('upload_as_doc', False)
+        return (await self.get_settings(id))['upload_as_doc']
 
     async def set_thumbnail(self, id, thumbnail):
-        await self.col.update_one({'id': id}, {'$set': {'thumbnail': thumbnail}})
+        await self.set_setting(id, 'thumbnail', thumbnail)
 
     async def get_thumbnail(self, id):
-        user = await self.col.find_one({'id': int(id)})
-        return user.get('thumbnail', None)
+        return (await self.get_settings(id))['thumbnail']
 
     async def set_generate_ss(self, id, generate_ss):
-        await self.col.update_one({'id': id}, {'$set': {'generate_ss': generate_ss}})
+        await self.set_setting(id, 'generate_ss', generate_ss)
 
     async def get_generate_ss(self, id):
-        user = await self.col.find_one({'id': int(id)})
-        return user.get('generate_ss', False)
+        return (await self.get_settings(id))['generate_ss']
 
     async def set_generate_sample_video(self, id, generate_sample_video):
-        await self.col.update_one({'id': id}, {'$set': {'generate_sample_video': generate_sample_video}})
+        await self.set_setting(id, 'generate_sample_video', generate_sample_video)
 
     async def get_generate_sample_video(self, id):
-        user = await self.col.find_one({'id': int(id)})
-        return user.get('generate_sample_video', False)
+        return (await self.get_settings(id))['generate_sample_video']
+
+    async def get_merge_result(self, key):
+        merge = await self.merges.find_one({'key': key})
+        return merge.get('file_id') if merge else None
+
+    async def set_merge_result(self, key, file_id):
+        await self.merges.update_one(
+            {'key': key},
+            {'$set': {'file_id': file_id, 'date': datetime.date.today().isoformat()}},
+            upsert=True
+        )
+
+    async def delete_merge_result(self, key):
+        await self.merges.delete_one({'key': key})
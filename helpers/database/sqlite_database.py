@@ -0,0 +1,203 @@
+# (c) @Savior_128
+
+import os
+import sqlite3
+import asyncio
+import logging
+import datetime
+import threading
+from helpers.database.database import Database, SETTINGS_DEFAULTS
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched per query while iterating over all users
+USER_BATCH_SIZE = 500
+
+
+class SQLiteDatabase(Database):
+    """
+    Database backed by a local SQLite file instead of MongoDB.
+
+    The file runs in WAL mode and every query runs in a worker thread, so
+    the event loop never blocks on disk. Settings and merge-cache writes
+    are queued and committed together in one transaction shortly after
+    they are made; the in-memory settings cache already reflects them.
+    """
+
+    def __init__(self, path, settings_cache_size=1024, settings_ttl=300, flush_interval=0.05):
+        self._init_caches(settings_cache_size, settings_ttl)
+        self.path = path
+        self.flush_interval = flush_interval
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn_lock = threading.Lock()
+        self._pending = []
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+        self._execute("PRAGMA journal_mode=WAL")
+        self._execute("PRAGMA synchronous=NORMAL")
+        self._execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            "id INTEGER PRIMARY KEY, join_date TEXT, upload_as_doc INTEGER, thumbnail TEXT, "
+            "generate_ss INTEGER, generate_sample_video INTEGER)"
+        )
+        self._execute("CREATE TABLE IF NOT EXISTS merges (key TEXT PRIMARY KEY, file_id TEXT, date TEXT)")
+
+    def _execute(self, sql, params=(), fetch=None):
+        with self._conn_lock:
+            cursor = self._conn.execute(sql, params)
+            if fetch == "one":
+                return cursor.fetchone()
+            if fetch == "all":
+                return cursor.fetchall()
+            return cursor.rowcount
+
+    async def _query(self, sql, params=(), fetch=None):
+        return await asyncio.to_thread(self._execute, sql, params, fetch)
+
+    def _write_batch(self, batch):
+        with self._conn_lock:
+            self._conn.execute("BEGIN")
+            try:
+                for sql, params, _ in batch:
+                    self._conn.execute(sql, params)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _queue_write(self, sql, params, user_id=None):
+        self._pending.append((sql, params, user_id))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        """Commit all queued writes now."""
+        # Serialized, so batches are committed in the order they were queued
+        async with self._flush_lock:
+            batch, self._pending = self._pending, []
+            if not batch:
+                return
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except Exception as e:
+                # The batch was rolled back; cached settings it carried must be read again
+                logger.error(f"Failed to commit {len(batch)} queued writes to {self.path}: {e}")
+                for _, _, user_id in batch:
+                    if user_id is not None:
+                        self._settings.pop(user_id, None)
+
+    async def ensure_indexes(self):
+        # Both tables are keyed by their primary key already
+        pass
+
+    async def warm_known_users(self):
+        rows = await self._query("SELECT id FROM users", fetch="all")
+        self._known_users.update(row["id"] for row in rows)
+
+    async def add_user(self, id):
+        id = int(id)
+        if id in self._known_users:
+            return False
+        user = self.new_user(id)
+        inserted = await self._query(
+            "INSERT OR IGNORE INTO users (id, join_date, upload_as_doc, thumbnail, generate_ss, generate_sample_video) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (id, user['join_date'], user['upload_as_doc'], user['thumbnail'], user['generate_ss'], user['generate_sample_video'])
+        )
+        self._known_users.add(id)
+        return inserted > 0
+
+    async def is_user_exist(self, id):
+        if int(id) in self._known_users:
+            return True
+        row = await self._query("SELECT 1 FROM users WHERE id = ?", (int(id),), fetch="one")
+        if row:
+            self._known_users.add(int(id))
+        return row is not None
+
+    async def total_users_count(self):
+        row = await self._query("SELECT COUNT(*) AS count FROM users", fetch="one")
+        return row["count"]
+
+    async def get_all_users(self):
+        async def iterate():
+            last_id = None
+            while True:
+                if last_id is None:
+                    rows = await self._query("SELECT * FROM users ORDER BY id LIMIT ?", (USER_BATCH_SIZE,), fetch="all")
+                else:
+                    rows = await self._query(
+                        "SELECT * FROM users WHERE id > ? ORDER BY id LIMIT ?",
+                        (last_id, USER_BATCH_SIZE),
+                        fetch="all"
+                    )
+                if not rows:
+                    return
+                for row in rows:
+                    yield dict(row)
+                last_id = rows[-1]["id"]
+        return iterate()
+
+    async def iter_user_ids(self, batch_size=USER_BATCH_SIZE):
+        last_id = -1
+        while True:
+            rows = await self._query(
+                "SELECT id FROM users WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, batch_size),
+                fetch="all"
+            )
+            if not rows:
+                return
+            for row in rows:
+                yield row["id"]
+            last_id = rows[-1]["id"]
+
+    async def delete_users(self, user_ids):
+        user_ids = [int(user_id) for user_id in user_ids]
+        if not user_ids:
+            return
+        placeholders = ", ".join("?" for _ in user_ids)
+        await self._query(f"DELETE FROM users WHERE id IN ({placeholders})", tuple(user_ids))
+        for user_id in user_ids:
+            self._settings.pop(user_id, None)
+            self._known_users.discard(user_id)
+
+    async def delete_user(self, user_id):
+        await self._query("DELETE FROM users WHERE id = ?", (int(user_id),))
+        self._settings.pop(int(user_id), None)
+        self._known_users.discard(int(user_id))
+
+    async def _load_settings(self, id):
+        # Queued writes must land before the row is read back
+        await self.flush()
+        row = await self._query("SELECT * FROM users WHERE id = ?", (id,), fetch="one")
+        settings = {}
+        for key, default in SETTINGS_DEFAULTS.items():
+            value = row[key] if row is not None and row[key] is not None else default
+            settings[key] = bool(value) if isinstance(default, bool) else value
+        return settings
+
+    async def _store_setting(self, id, key, value):
+        if key not in SETTINGS_DEFAULTS:
+            raise KeyError(key)
+        self._queue_write(f"UPDATE users SET {key} = ? WHERE id = ?", (value, id), user_id=id)
+
+    async def get_merge_result(self, key):
+        await self.flush()
+        row = await self._query("SELECT file_id FROM merges WHERE key = ?", (key,), fetch="one")
+        return row["file_id"] if row else None
+
+    async def set_merge_result(self, key, file_id):
+        self._queue_write(
+            "INSERT OR REPLACE INTO merges (key, file_id, date) VALUES (?, ?, ?)",
+            (key, file_id, datetime.date.today().isoformat())
+        )
+
+    async def delete_merge_result(self, key):
+        self._queue_write("DELETE FROM merges WHERE key = ?", (key,))
@@ -0,0 +1,188 @@
+# (c) @Savior_128
+
+import os
+import time
+import shutil
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, List, Optional
+from configs import Config
+from helpers.download_cache import download_cache
+from helpers.ffmpeg import exceeds_telegram_limit
+from pyrogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+# Seconds between free-space re-checks while a job waits for a reservation
+RESERVE_POLL = 10.0
+
+
+def _path_size(path: str) -> int:
+    """Size in bytes of a file, or of all files below a directory."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                size += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                continue
+    return size
+
+
+def _same_disk(first: str, second: str) -> bool:
+    """Check whether two directories live on the same filesystem."""
+    try:
+        return os.stat(first).st_dev == os.stat(second).st_dev
+    except OSError:
+        return False
+
+
+def estimate_merge_bytes(messages: List[Message], download_bytes: int, streamed: bool = False) -> int:
+    """
+    Estimate the disk space a merge job will use.
+
+    The output is about as large as the inputs, or capped at the Telegram
+    limit when it is encoded to fit. Normalized copies of the clips are
+    only expected when Telegram reports differing resolutions or codecs,
+    and never when the merge is encoded to fit or streamed, since both
+    encode in a single pass. Streamed merges download nothing.
+
+    Args:
+        messages: Queued messages of the job.
+        download_bytes: Bytes of the clips that still have to be downloaded.
+        streamed: True if the clips are piped into FFmpeg instead of downloaded.
+
+    Returns:
+        int: Expected bytes of downloads, intermediates and output.
+    """
+    media = [msg.video or msg.document for msg in messages]
+    input_bytes = sum(m.file_size or 0 for m in media)
+    fit_to_telegram = exceeds_telegram_limit(input_bytes)
+    output_bytes = Config.TG_MAX_FILE_SIZE if fit_to_telegram else input_bytes
+    if streamed:
+        return output_bytes
+    profiles = {(getattr(m, "width", None), getattr(m, "height", None), m.mime_type) for m in media}
+    intermediate_bytes = input_bytes if len(profiles) > 1 and not fit_to_telegram else 0
+    return download_bytes + intermediate_bytes + output_bytes
+
+
+class DiskLedger:
+    """
+    Reservations of free disk space for running jobs.
+
+    A job reserves its estimated usage before it starts and registers the
+    paths it writes to. Space a job has reserved but not written yet is
+    treated as used, so concurrent jobs cannot together promise more than
+    the disk has. Jobs that do not fit first get space from `reclaim`, a
+    callable evicting reusable files such as the download cache, and then
+    wait until others release space.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        headroom: int,
+        reclaim: Optional[Callable[[int, Iterable[str]], int]] = None
+    ):
+        self.path = path
+        self.headroom = max(0, headroom)
+        self.reclaim = reclaim
+        self._reserved: Dict[Hashable, int] = {}
+        self._paths: Dict[Hashable, List[str]] = {}
+        self._started: Dict[Hashable, float] = {}
+        self._changed = asyncio.Event()
+
+    def _free(self) -> int:
+        os.makedirs(self.path, exist_ok=True)
+        return shutil.disk_usage(self.path).free
+
+    def written(self, job: Hashable) -> int:
+        """Bytes a job has written so far to its registered paths."""
+        return sum(_path_size(path) for path in self._paths.get(job, []) if os.path.exists(path))
+
+    def outstanding(self, exclude: Optional[Hashable] = None) -> int:
+        """Reserved bytes that jobs have not written yet."""
+        return sum(
+            max(0, reserved - self.written(job))
+            for job, reserved in self._reserved.items()
+            if job != exclude
+        )
+
+    def available(self) -> int:
+        """Free bytes not promised to any running job."""
+        return self._free() - self.headroom - self.outstanding()
+
+    async def reserve(
+        self,
+        job: Hashable,
+        nbytes: int,
+        paths: List[str],
+        on_wait: Optional[Callable[[int], Awaitable[None]]] = None,
+        keep: Iterable[str] = ()
+    ) -> bool:
+        """
+        Reserve disk space for a job, waiting until enough is available.
+
+        An earlier reservation of the same job is replaced.
+
+        Args:
+            job: Job identifier (the user ID).
+            nbytes: Estimated bytes the job will write.
+            paths: Files or directories whose size counts as written by the job.
+            on_wait: Optional coroutine called with the missing bytes when
+                the job has to wait.
+            keep: Ids of reclaimable files the job itself will use.
+
+        Returns:
+            bool: False if the job can never fit, even with no other job running.
+        """
+        self.release(job)
+        notified = False
+        while True:
+            shortfall = nbytes - (self._free() - self.headroom - self.outstanding())
+            if shortfall > 0 and self.reclaim is not None and self.reclaim(shortfall, keep):
+                shortfall = nbytes - (self._free() - self.headroom - self.outstanding())
+            if shortfall <= 0:
+                break
+            if not self._reserved:
+                logger.error(f"Job {job} needs {nbytes} bytes, only {nbytes - shortfall} can be freed")
+                return False
+            if on_wait is not None and not notified:
+                notified = True
+                await on_wait(shortfall)
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=RESERVE_POLL)
+            except asyncio.TimeoutError:
+                pass
+        self._reserved[job] = nbytes
+        self._paths[job] = list(paths)
+        self._started[job] = time.time()
+        return True
+
+    def track(self, job: Hashable, path: str) -> None:
+        """Count another file or directory as written by a job."""
+        if job in self._paths:
+            self._paths[job].append(path)
+
+    def release(self, job: Hashable) -> None:
+        """Drop a job's reservation and wake up waiting jobs."""
+        if self._reserved.pop(job, None) is not None:
+            self._paths.pop(job, None)
+            self._started.pop(job, None)
+            self._changed.set()
+
+    def active_jobs(self) -> Dict[Hashable, float]:
+        """Jobs holding a reservation, with the time they started."""
+        return dict(self._started)
+
+
+os.makedirs(Config.DOWN_PATH, exist_ok=True)
+disk_ledger = DiskLedger(
+    Config.DOWN_PATH,
+    Config.DISK_HEADROOM,
+    # Evicting cached clips only frees space for jobs on the same disk
+    reclaim=download_cache.reclaim if _same_disk(Config.DOWN_PATH, download_cache.root) else None
+)
@@ -1,6 +1,8 @@
 import math
 import time
+from typing import Dict, Hashable
 from configs import Config
+from pyrogram.enums import ParseMode
 from pyrogram.types import Message
 
 
@@ -48,6 +50,85 @@ async def progress_for_pyrogram(current: int, total: int, ud_type: str, message:
             pass  # Silently ignore errors (e.g., MessageNotModified)
 
 
+class CombinedProgress:
+    """
+    Sum the progress of parallel transfers into one status message.
+
+    Pass `update` as the Pyrogram progress callback with the transfer key
+    as its only progress argument.
+    """
+
+    def __init__(self, ud_type: str, message: Message, sizes: Dict[Hashable, int]):
+        """
+        Args:
+            ud_type: Type of operation (e.g., "Downloading").
+            message: Pyrogram Message object to edit with progress.
+            sizes: Expected size in bytes of every transfer, by key.
+        """
+        self.ud_type = ud_type
+        self.message = message
+        self.sizes = dict(sizes)
+        self.current: Dict[Hashable, int] = {}
+        self.start = time.time()
+
+    async def update(self, current: int, total: int, key: Hashable) -> None:
+        self.current[key] = current
+        self.sizes[key] = total
+        await self._report()
+
+    def drop(self, key: Hashable) -> None:
+        """Forget a transfer that failed, so it no longer counts towards the total."""
+        self.current.pop(key, None)
+        self.sizes.pop(key, None)
+
+    async def _report(self) -> None:
+        total = sum(self.sizes.values())
+        if total > 0:
+            await progress_for_pyrogram(sum(self.current.values()), total, self.ud_type, self.message, self.start)
+
+
+async def progress_for_ffmpeg(current: float, total: float, ud_type: str, message: Message, start: float) -> None:
+    """
+    Display progress for an FFmpeg encode reported through -progress.
+
+    Args:
+        current: Seconds of output media written so far.
+        total: Expected output duration in seconds.
+        ud_type: Type of operation (e.g., "Merging").
+        message: Pyrogram Message object to edit with progress.
+        start: Start time of the operation (from time.time()).
+    """
+    if total <= 0:
+        return
+    current = min(current, total)
+    now = time.time()
+    diff = now - start
+    if round(diff % 10.00) == 0 or current == total:
+        percentage = current * 100 / total
+        speed = current / diff if diff > 0 else 0
+        time_to_completion = round((total - current) / speed) * 1000 if speed > 0 else 0
+
+        progress = "[{0}{1}] \n".format(
+            ''.join(["●" for _ in range(math.floor(percentage / 5))]),
+            ''.join(["○" for _ in range(20 - math.floor(percentage / 5))])
+        )
+
+        tmp = progress + Config.FFMPEG_PROGRESS.format(
+            round(percentage, 2),
+            TimeFormatter(milliseconds=current * 1000) or "0 s",
+            TimeFormatter(milliseconds=total * 1000) or "0 s",
+            round(speed, 2),
+            TimeFormatter(milliseconds=time_to_completion) or "0 s"
+        )
+        try:
+            await message.edit_text(
+                text=f"**{ud_type}**\n\n{tmp}",
+                parse_mode=ParseMode.MARKDOWN
+            )
+        except Exception:
+            pass  # Silently ignore errors (e.g., MessageNotModified)
+
+
 def humanbytes(size: int) -> str:
     """
     Convert bytes to human-readable format (e.g., KiB, MiB).
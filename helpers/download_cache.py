@@ -0,0 +1,190 @@
+# (c) @Savior_128
+
+import os
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+from configs import Config
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadCache:
+    """
+    Shared on-disk store of downloaded Telegram media, keyed by file_unique_id.
+
+    Files live in `root` as `<file_unique_id>.<ext>`, so every user merging
+    the same clip reads the same copy. The total size is kept under
+    `max_bytes` by evicting the least recently used files, but a file is
+    never evicted while a job holds a reference to it.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max(0, max_bytes)
+        self._entries: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self._refs: Dict[str, int] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._scan()
+
+    def _scan(self) -> None:
+        """Rebuild the index from the files left by a previous run, oldest download first."""
+        os.makedirs(self.root, exist_ok=True)
+        found = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.endswith(".part"):
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            found.append((stat.st_mtime, name.rsplit(".", 1)[0], path, stat.st_size))
+        for _, file_unique_id, path, size in sorted(found):
+            self._entries[file_unique_id] = (path, size)
+        if found:
+            logger.info(f"Download cache holds {len(found)} files ({self.total_bytes} bytes)")
+
+    def __contains__(self, file_unique_id: str) -> bool:
+        entry = self._entries.get(file_unique_id)
+        return entry is not None and os.path.exists(entry[0])
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(size for _, size in self._entries.values())
+
+    def _lookup(self, file_unique_id: str) -> Optional[str]:
+        entry = self._entries.get(file_unique_id)
+        if entry is None:
+            return None
+        path = entry[0]
+        if not os.path.exists(path):
+            del self._entries[file_unique_id]
+            return None
+        # Recency lives in the OrderedDict only; the mtime is part of the probe cache key
+        self._entries.move_to_end(file_unique_id)
+        return path
+
+    async def fetch(
+        self,
+        file_unique_id: str,
+        ext: str,
+        download: Callable[[str], Awaitable[str]]
+    ) -> str:
+        """
+        Get a cached media file, downloading it on a miss, and hold a reference to it.
+
+        Concurrent requests for the same media share one download. Every
+        successful call must be paired with release().
+
+        Args:
+            file_unique_id: Telegram file_unique_id of the media.
+            ext: File extension to store the media under.
+            download: Coroutine downloading the media to the given path and
+                returning the path it wrote.
+
+        Returns:
+            str: Path to the cached file.
+        """
+        self._refs[file_unique_id] = self._refs.get(file_unique_id, 0) + 1
+        try:
+            path = self._lookup(file_unique_id)
+            if path is not None:
+                return path
+            inflight = self._inflight.get(file_unique_id)
+            if inflight is None:
+                inflight = asyncio.ensure_future(self._download(file_unique_id, ext, download))
+                self._inflight[file_unique_id] = inflight
+                inflight.add_done_callback(lambda future: self._forget(file_unique_id, future))
+            # Shielded, so one job giving up does not abort the download for the others
+            return await asyncio.shield(inflight)
+        except (Exception, asyncio.CancelledError):
+            self.release(file_unique_id)
+            raise
+
+    def _forget(self, file_unique_id: str, future: asyncio.Future) -> None:
+        self._inflight.pop(file_unique_id, None)
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Download of {file_unique_id} failed: {future.exception()}")
+
+    async def _download(self, file_unique_id: str, ext: str, download: Callable[[str], Awaitable[str]]) -> str:
+        final_path = os.path.join(self.root, f"{file_unique_id}.{ext}")
+        part_path = f"{final_path}.part"
+        try:
+            downloaded = await download(part_path)
+            os.replace(downloaded, final_path)
+        except (Exception, asyncio.CancelledError):
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+        self._entries[file_unique_id] = (final_path, os.path.getsize(final_path))
+        self._evict()
+        return final_path
+
+    def release(self, file_unique_id: str) -> None:
+        """Drop a reference taken by fetch(); unreferenced files become evictable."""
+        refs = self._refs.get(file_unique_id, 0) - 1
+        if refs > 0:
+            self._refs[file_unique_id] = refs
+            return
+        self._refs.pop(file_unique_id, None)
+        self._evict()
+
+    def release_all(self, file_unique_ids: Iterable[str]) -> None:
+        """Drop one reference for each of the given ids."""
+        for file_unique_id in file_unique_ids:
+            self.release(file_unique_id)
+
+    def discard(self, file_unique_id: str) -> None:
+        """Remove a cached file that turned out to be unusable, even if referenced."""
+        entry = self._entries.pop(file_unique_id, None)
+        if entry is not None and os.path.exists(entry[0]):
+            os.remove(entry[0])
+
+    def reclaim(self, nbytes: int, keep: Iterable[str] = ()) -> int:
+        """
+        Evict unreferenced files, least recently used first, to free disk space.
+
+        Args:
+            nbytes: Bytes wanted.
+            keep: file_unique_ids that must stay, e.g. clips the caller is about to use.
+
+        Returns:
+            int: Bytes actually freed.
+        """
+        keep = set(keep)
+        freed = 0
+        for file_unique_id in list(self._entries):
+            if freed >= nbytes:
+                break
+            if self._refs.get(file_unique_id) or file_unique_id in keep or file_unique_id in self._inflight:
+                continue
+            path, size = self._entries.pop(file_unique_id)
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Failed to evict {path}: {e}")
+                continue
+            freed += size
+        if freed:
+            logger.info(f"Evicted {freed} bytes from the download cache to make room")
+        return freed
+
+    def _evict(self) -> None:
+        total = self.total_bytes
+        for file_unique_id in list(self._entries):
+            if total <= self.max_bytes:
+                break
+            if self._refs.get(file_unique_id):
+                continue
+            path, size = self._entries.pop(file_unique_id)
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Failed to evict {path}: {e}")
+            total -= size
+
+
+download_cache = DownloadCache(
+    root=os.path.join(Config.CACHE_PATH, "media"),
+    max_bytes=Config.DOWNLOAD_CACHE_SIZE
+)
@@ -5,11 +5,16 @@ import asyncio
 import json
 import os
 import time
+import uuid
 import logging
-import shutil
+import itertools
 import psutil
-from typing import List, Optional, Dict
+from collections import deque
+from typing import Awaitable, Callable, Deque, List, Optional, Dict, Tuple
 from configs import Config
+from helpers.display_progress import progress_for_ffmpeg
+from helpers.probe_cache import probe_cache
+from helpers.scheduler import scheduler, job_priority, PRIORITY_NORMAL, QueueCallback
 from pyrogram.types import Message
 from pyrogram.enums import ParseMode
 from pyrogram.errors import MessageNotModified
@@ -17,16 +22,61 @@ from pyrogram.errors import MessageNotModified
 # Configure logging
 logger = logging.getLogger(__name__)
 
-async def get_video_info(video_file: str) -> Optional[Dict]:
+# Lines of FFmpeg stderr kept for error reports
+STDERR_TAIL_LINES = 40
+
+# Target-size encoding: share of the size limit to aim for (muxing overhead),
+# audio bitrate and lowest video bitrate worth encoding at, in kbit/s
+TARGET_SIZE_HEADROOM = 0.95
+TARGET_AUDIO_BITRATE = 128
+MIN_TARGET_VIDEO_BITRATE = 200
+
+# Encoders able to reproduce a probed codec when normalizing clips
+VIDEO_ENCODERS = {
+    "h264": "libx264",
+    "hevc": "libx265",
+    "vp8": "libvpx",
+    "vp9": "libvpx-vp9"
+}
+AUDIO_ENCODERS = {
+    "aac": "aac",
+    "mp3": "libmp3lame",
+    "opus": "libopus",
+    "vorbis": "libvorbis",
+    "ac3": "ac3"
+}
+
+# MP4 muxer flags per OUTPUT_PROFILE. Both put the index ahead of the media,
+# so players can start before the whole file has arrived. Fragmented output
+# is written that way while muxing; faststart moves the moov box when done.
+MP4_OUTPUT_FLAGS = {
+    "fragmented": ["-movflags", "+frag_keyframe+empty_moov+default_base_moof"],
+    "faststart": ["-movflags", "+faststart"],
+    "plain": []
+}
+
+async def get_video_info(
+    video_file: str,
+    file_unique_id: Optional[str] = None,
+    cache: bool = True
+) -> Optional[Dict]:
     """
     Get video file information using ffprobe.
 
+    Results are served from the probe cache when the same file, or the same
+    Telegram media, was probed before.
+
     Args:
         video_file: Path to the video file.
+        file_unique_id: Telegram file_unique_id of the media, if known.
+        cache: False for temporary files, whose results are not worth keeping.
 
     Returns:
         dict: Video info (streams, format) or None if failed.
     """
+    cached = probe_cache.get(video_file, file_unique_id) if cache else None
+    if cached is not None:
+        return cached
     try:
         cmd = [
             "ffprobe",
@@ -47,7 +97,10 @@ async def get_video_info(video_file: str) -> Optional[Dict]:
         if process.returncode != 0:
             logger.error(f"ffprobe failed for {video_file}: {stderr_str}")
             return None
-        return json.loads(stdout.decode("utf-8"))
+        video_info = json.loads(stdout.decode("utf-8"))
+        if cache:
+            probe_cache.put(video_file, video_info, file_unique_id)
+        return video_info
     except FileNotFoundError:
         logger.error("ffprobe executable not found")
         return None
@@ -55,11 +108,515 @@ async def get_video_info(video_file: str) -> Optional[Dict]:
         logger.error(f"ffprobe error for {video_file}: {e}")
         return None
 
+def get_media_metadata(video_info: Optional[Dict]) -> Tuple[int, int, int]:
+    """
+    Read duration, width and height from an ffprobe result.
+
+    Args:
+        video_info: ffprobe result from get_video_info.
+
+    Returns:
+        tuple: (duration in whole seconds, width, height); 0 where unknown.
+    """
+    if not video_info:
+        return 0, 0, 0
+    video = _first_stream(video_info, "video") or {}
+    return int(_duration_of(video_info)), int(video.get("width") or 0), int(video.get("height") or 0)
+
+def _stream_signature(video_info: Dict) -> tuple:
+    """
+    Build a comparable signature of the first video and audio stream.
+
+    Two files with the same signature can be joined by the concat demuxer
+    with stream copy, without re-encoding.
+
+    Args:
+        video_info: ffprobe result from get_video_info.
+
+    Returns:
+        tuple: (video parameters, audio parameters or None).
+    """
+    streams = video_info.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), {})
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+    video_sig = (
+        video.get("codec_name"),
+        video.get("profile"),
+        video.get("width"),
+        video.get("height"),
+        video.get("r_frame_rate"),
+        video.get("pix_fmt"),
+        video.get("time_base")
+    )
+    audio_sig = None
+    if audio is not None:
+        audio_sig = (
+            audio.get("codec_name"),
+            audio.get("sample_rate"),
+            audio.get("channels"),
+            audio.get("channel_layout")
+        )
+    return video_sig, audio_sig
+
+def _first_stream(video_info: Dict, codec_type: str) -> Optional[Dict]:
+    """Return the first stream of the given codec type ('video' or 'audio'), if any."""
+    return next(
+        (stream for stream in video_info.get("streams", []) if stream.get("codec_type") == codec_type),
+        None
+    )
+
+def _pick_reference(video_infos: List[Dict], signatures: List[tuple]) -> int:
+    """
+    Choose the input whose stream profile covers the most playback time.
+
+    Normalizing every other clip to this profile re-encodes the fewest seconds.
+
+    Args:
+        video_infos: ffprobe results, in merge order.
+        signatures: Matching _stream_signature values.
+
+    Returns:
+        int: Index of the first input having the chosen profile.
+    """
+    covered: Dict[tuple, float] = {}
+    for info, signature in zip(video_infos, signatures):
+        covered[signature] = covered.get(signature, 0.0) + _duration_of(info)
+    best = max(covered, key=lambda sig: covered[sig])
+    return signatures.index(best)
+
+def _can_normalize_to(reference_info: Dict) -> bool:
+    """Check that FFmpeg can encode clips to the reference codecs."""
+    video = _first_stream(reference_info, "video") or {}
+    audio = _first_stream(reference_info, "audio")
+    if video.get("codec_name") not in VIDEO_ENCODERS:
+        return False
+    return audio is None or audio.get("codec_name") in AUDIO_ENCODERS
+
+async def _read_stderr_tail(stream: asyncio.StreamReader, tail: Deque[str]) -> None:
+    """Drain FFmpeg stderr, keeping only the last lines for error reports."""
+    pending = b""
+    while True:
+        chunk = await stream.read(4096)
+        if not chunk:
+            break
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            tail.append(line.decode("utf-8", errors="replace").rstrip())
+    if pending:
+        tail.append(pending.decode("utf-8", errors="replace").rstrip())
+
+async def _run_ffmpeg(
+    command: List[str],
+    progress: Optional[Callable[[float], Awaitable[None]]] = None,
+    priority: int = PRIORITY_NORMAL,
+    on_queued: Optional[QueueCallback] = None
+) -> Tuple[int, str]:
+    """
+    Run an FFmpeg command, following its machine-readable progress channel.
+
+    The process only starts once the global scheduler grants it a slot, and
+    its decoders, filters and encoder are limited to the thread share the
+    scheduler assigns to it.
+    Progress lines are parsed as they arrive instead of buffering the whole
+    output, and stderr is kept in a bounded ring buffer, so memory use does
+    not grow with the length of the encode.
+
+    Args:
+        command: Full FFmpeg argument list, starting with "ffmpeg".
+        progress: Optional coroutine called with the seconds of output written.
+        priority: Scheduling priority of the job.
+        on_queued: Optional coroutine called with the queue position while waiting.
+
+    Returns:
+        tuple: (return code, last lines of stderr).
+    """
+    async with scheduler.slot(priority, on_queued, label=os.path.basename(command[-1])) as threads:
+        # -threads caps the decoder of the input that follows it, and the encoder before the output
+        limited = [command[0], "-filter_threads", str(threads)]
+        for arg in command[1:-1]:
+            if arg == "-i":
+                limited += ["-threads", str(threads)]
+            limited.append(arg)
+        command = [*limited, "-threads", str(threads), command[-1]]
+        return await _spawn_ffmpeg(command, progress)
+
+async def _spawn_ffmpeg(
+    command: List[str],
+    progress: Optional[Callable[[float], Awaitable[None]]] = None
+) -> Tuple[int, str]:
+    """Start FFmpeg with -progress on stdout and wait for it; see _run_ffmpeg."""
+    command = [command[0], "-progress", "pipe:1", "-nostats", *command[1:]]
+    logger.info(f"Executing FFmpeg command: {' '.join(command)}")
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    tail: Deque[str] = deque(maxlen=STDERR_TAIL_LINES)
+    stderr_task = asyncio.create_task(_read_stderr_tail(process.stderr, tail))
+    try:
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                break
+            key, _, value = line.decode("utf-8", errors="replace").strip().partition("=")
+            if key == "out_time_us" and progress is not None:
+                try:
+                    await progress(int(value) / 1_000_000)
+                except ValueError:
+                    pass  # "N/A" before the first frame is muxed
+        await stderr_task
+        await process.wait()
+    except asyncio.CancelledError:
+        if process.returncode is None:
+            process.kill()
+        stderr_task.cancel()
+        raise
+    stderr_str = "\n".join(tail)
+    logger.debug(f"FFmpeg stderr: {stderr_str}")
+    return process.returncode, stderr_str
+
+def _progress_reporter(
+    message: Optional[Message],
+    ud_type: str,
+    total_duration: float
+) -> Optional[Callable[[float], Awaitable[None]]]:
+    """
+    Build a progress callback for _run_ffmpeg that edits a status message.
+
+    Args:
+        message: Status message to edit, or None to report nothing.
+        ud_type: Title shown above the progress bar.
+        total_duration: Expected output duration in seconds.
+
+    Returns:
+        Callback or None when progress cannot be shown.
+    """
+    if message is None or total_duration <= 0:
+        return None
+    start = time.time()
+
+    async def report(done: float) -> None:
+        await progress_for_ffmpeg(done, total_duration, ud_type, message, start)
+
+    return report
+
+def exceeds_telegram_limit(projected_size: int) -> bool:
+    """
+    Check whether a merge of this projected size will use target-size encoding.
+
+    Args:
+        projected_size: Expected output size in bytes.
+
+    Returns:
+        bool: True if FIT_TO_TELEGRAM is on and the size is over the limit.
+    """
+    return Config.FIT_TO_TELEGRAM and projected_size > Config.TG_MAX_FILE_SIZE
+
+def _target_video_bitrate(total_duration: float) -> int:
+    """
+    Compute the video bitrate that lands an encode just under the Telegram limit.
+
+    Args:
+        total_duration: Output duration in seconds.
+
+    Returns:
+        int: Video bitrate in kbit/s.
+    """
+    budget_bits = Config.TG_MAX_FILE_SIZE * TARGET_SIZE_HEADROOM * 8
+    total_kbps = budget_bits / total_duration / 1000
+    return max(MIN_TARGET_VIDEO_BITRATE, int(total_kbps - TARGET_AUDIO_BITRATE))
+
+def _queue_notifier(message: Optional[Message]) -> Optional[QueueCallback]:
+    """
+    Build an on_queued callback for _run_ffmpeg that shows the queue position.
+
+    Args:
+        message: Status message to edit, or None to report nothing.
+
+    Returns:
+        Callback or None.
+    """
+    if message is None:
+        return None
+
+    async def notify(position: int) -> None:
+        try:
+            await message.edit_text(
+                f"سرور مشغول است، کار شما در صف پردازش قرار گرفت.\nموقعیت شما در صف: {position}",
+                parse_mode=ParseMode.MARKDOWN
+            )
+        except MessageNotModified:
+            pass
+
+    return notify
+
+def _duration_of(video_info: Dict) -> float:
+    """Return the container duration in seconds from an ffprobe result."""
+    try:
+        return float(video_info.get("format", {}).get("duration", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+def _parse_frame_rate(video_stream: Dict) -> float:
+    """Parse r_frame_rate of a video stream safely, defaulting to 30."""
+    frame_rate_str = video_stream.get("r_frame_rate", "30/1")
+    try:
+        num, denom = map(int, frame_rate_str.split("/"))
+        return num / denom if denom != 0 else 30
+    except (ValueError, ZeroDivisionError):
+        logger.warning(f"Invalid frame rate {frame_rate_str}, defaulting to 30")
+        return 30
+
+def _output_flags(output_file: str) -> List[str]:
+    """Muxer flags making an MP4 output streamable, per Config.OUTPUT_PROFILE."""
+    if not output_file.lower().endswith((".mp4", ".mov")):
+        return []
+    return MP4_OUTPUT_FLAGS.get(Config.OUTPUT_PROFILE, MP4_OUTPUT_FLAGS["fragmented"])
+
+def _copy_command(list_file: str, output_file: str) -> List[str]:
+    """FFmpeg command joining the files of a concat list with stream copy."""
+    return [
+        "ffmpeg",
+        "-f", "concat",
+        "-safe", "0",
+        "-i", list_file,
+        "-c", "copy",
+        *_output_flags(output_file),
+        "-y",
+        output_file
+    ]
+
+def _reencode_command(
+    list_file: str,
+    output_file: str,
+    width: int,
+    height: int,
+    frame_rate: float,
+    video_bitrate: Optional[int] = None
+) -> List[str]:
+    """
+    FFmpeg command re-encoding the files of a concat list to one profile.
+
+    Args:
+        list_file: Path to the concat demuxer list.
+        output_file: Path to the merged output.
+        width: Output width; inputs are scaled and padded to it.
+        height: Output height.
+        frame_rate: Output frame rate.
+        video_bitrate: Cap in kbit/s for target-size encoding, or None.
+
+    Returns:
+        list: FFmpeg argument list.
+    """
+    # FFmpeg command with scale filter to unify resolution
+    command = [
+        "ffmpeg",
+        "-f", "concat",
+        "-safe", "0",
+        "-i", list_file,
+        "-vf", f"scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,fps={frame_rate}",
+        "-c:v", "libx264",
+        "-preset", "fast"
+    ]
+    if video_bitrate is not None:
+        # Capped CRF: quality-driven, but the VBV cap keeps the average under the size budget
+        command += [
+            "-crf", "23",
+            "-maxrate", f"{video_bitrate}k",
+            "-bufsize", f"{video_bitrate * 2}k",
+            "-c:a", "aac",
+            "-b:a", f"{TARGET_AUDIO_BITRATE}k"
+        ]
+    else:
+        command += ["-c:a", "aac"]
+    command += _output_flags(output_file) + ["-y", output_file]
+    return command
+
+async def _concat_copy(
+    list_file: str,
+    output_file: str,
+    progress: Optional[Callable[[float], Awaitable[None]]] = None,
+    priority: int = PRIORITY_NORMAL,
+    on_queued: Optional[QueueCallback] = None
+) -> bool:
+    """
+    Join the files of a concat list with stream copy.
+
+    Args:
+        list_file: Path to the concat demuxer list.
+        output_file: Path to the merged output.
+        progress: Optional progress callback for _run_ffmpeg.
+        priority: Scheduling priority of the job.
+        on_queued: Optional queue position callback for _run_ffmpeg.
+
+    Returns:
+        bool: True if a non-empty output file was written.
+    """
+    command = _copy_command(list_file, output_file)
+    returncode, stderr_str = await _run_ffmpeg(command, progress, priority, on_queued)
+    if returncode == 0 and os.path.exists(output_file) and os.path.getsize(output_file) > 0:
+        logger.info(f"Merged video created by stream copy: {output_file}, Size: {os.path.getsize(output_file)} bytes")
+        return True
+    logger.warning(f"Stream copy merge failed, falling back to re-encode: {stderr_str}")
+    return False
+
+async def normalize_clip(
+    video_file: str,
+    video_info: Dict,
+    reference_info: Dict,
+    output_file: str,
+    progress: Optional[Callable[[float], Awaitable[None]]] = None,
+    priority: int = PRIORITY_NORMAL,
+    on_queued: Optional[QueueCallback] = None
+) -> Optional[str]:
+    """
+    Transcode one clip to the stream profile of a reference clip.
+
+    The result can be joined with the reference by the concat demuxer using
+    stream copy.
+
+    Args:
+        video_file: Path to the clip to transcode.
+        video_info: ffprobe result of the clip.
+        reference_info: ffprobe result of the reference clip.
+        output_file: Path to write the normalized clip to.
+        progress: Optional progress callback for _run_ffmpeg.
+        priority: Scheduling priority of the job.
+        on_queued: Optional queue position callback for _run_ffmpeg.
+
+    Returns:
+        Path to the normalized clip or None if failed.
+    """
+    ref_video = _first_stream(reference_info, "video")
+    ref_audio = _first_stream(reference_info, "audio")
+    width = ref_video.get("width")
+    height = ref_video.get("height")
+    frame_rate = ref_video.get("r_frame_rate", "30/1")
+    video_encoder = VIDEO_ENCODERS[ref_video.get("codec_name")]
+
+    command = ["ffmpeg", "-i", video_file]
+    has_audio = _first_stream(video_info, "audio") is not None
+    if ref_audio is not None and not has_audio:
+        # Reference has sound: give silent clips a matching silent track
+        command += [
+            "-f", "lavfi",
+            "-i", f"anullsrc=r={ref_audio.get('sample_rate', 44100)}:cl={ref_audio.get('channel_layout') or 'stereo'}",
+            "-shortest"
+        ]
+    command += [
+        "-map", "0:v:0",
+        "-vf", f"scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={frame_rate}",
+        "-c:v", video_encoder
+    ]
+    if video_encoder in ("libx264", "libx265"):
+        command += ["-preset", "fast"]
+    else:
+        command += ["-crf", "32", "-b:v", "0"]
+    profile = (ref_video.get("profile") or "").lower().replace("constrained ", "")
+    if video_encoder == "libx264" and profile in ("baseline", "main", "high"):
+        command += ["-profile:v", profile]
+    if ref_video.get("pix_fmt"):
+        command += ["-pix_fmt", ref_video["pix_fmt"]]
+    time_base = ref_video.get("time_base", "")
+    if output_file.lower().endswith(".mp4") and time_base.startswith("1/"):
+        command += ["-video_track_timescale", time_base[2:]]
+    if ref_audio is None:
+        command += ["-an"]
+    else:
+        command += [
+            "-map", "1:a:0" if not has_audio else "0:a:0",
+            "-c:a", AUDIO_ENCODERS[ref_audio.get("codec_name")]
+        ]
+        if ref_audio.get("sample_rate"):
+            command += ["-ar", str(ref_audio["sample_rate"])]
+        if ref_audio.get("channels"):
+            command += ["-ac", str(ref_audio["channels"])]
+    command += ["-y", output_file]
+
+    try:
+        returncode, stderr_str = await _run_ffmpeg(command, progress, priority, on_queued)
+        if returncode == 0 and os.path.exists(output_file) and os.path.getsize(output_file) > 0:
+            logger.info(f"Normalized clip created: {output_file}, Size: {os.path.getsize(output_file)} bytes")
+            return output_file
+        logger.error(f"Failed to normalize {video_file}: {stderr_str}")
+        return None
+    except FileNotFoundError:
+        logger.error("FFmpeg executable not found")
+        return None
+    except Exception as e:
+        logger.error(f"Failed to normalize {video_file}: {e}")
+        return None
+
+class ClipNormalizer:
+    """
+    Normalize clips to a reference profile as soon as each one is available.
+
+    Used while the rest of the queue is still downloading; MergeVideo then
+    reuses the finished segments instead of transcoding those clips again.
+    Clips added before the reference are held until it arrives.
+    """
+
+    def __init__(self, output_dir: str, format_: str, priority: int = PRIORITY_NORMAL):
+        self.segments_dir = os.path.join(output_dir, "normalized")
+        self.format_ = format_.lower()
+        self.priority = priority
+        self.reference_info: Optional[Dict] = None
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self._pending: List[Tuple[str, Dict]] = []
+        self._semaphore = asyncio.Semaphore(Config.NORMALIZE_WORKERS)
+        self._counter = itertools.count()
+
+    def add(self, video_file: str, video_info: Dict, reference: bool = False) -> None:
+        """
+        Register a clip that finished downloading.
+
+        Args:
+            video_file: Path to the clip.
+            video_info: ffprobe result of the clip.
+            reference: True if this clip defines the target profile.
+        """
+        if reference:
+            self.reference_info = video_info
+            pending, self._pending = self._pending, []
+            for item in pending:
+                self._start(*item)
+        elif self.reference_info is None:
+            self._pending.append((video_file, video_info))
+        else:
+            self._start(video_file, video_info)
+
+    def _start(self, video_file: str, video_info: Dict) -> None:
+        if video_file in self.tasks or not _can_normalize_to(self.reference_info):
+            return
+        if _stream_signature(video_info) == _stream_signature(self.reference_info):
+            return
+        os.makedirs(self.segments_dir, exist_ok=True)
+        output_file = os.path.join(self.segments_dir, f"early_{next(self._counter)}.{self.format_}")
+        self.tasks[video_file] = asyncio.create_task(self._normalize(video_file, video_info, output_file))
+
+    async def _normalize(self, video_file: str, video_info: Dict, output_file: str) -> Optional[str]:
+        async with self._semaphore:
+            return await normalize_clip(
+                video_file=video_file,
+                video_info=video_info,
+                reference_info=self.reference_info,
+                output_file=output_file,
+                priority=self.priority
+            )
+
+    def cancel(self) -> None:
+        """Stop normalizations that are still running."""
+        for task in self.tasks.values():
+            task.cancel()
+
 async def MergeVideo(
     input_file: str,
     user_id: str,
     message: Message,
-    format_: str = "mp4"  # Changed default to mp4 to match log
+    format_: str = "mp4",  # Changed default to mp4 to match log
+    normalizer: Optional[ClipNormalizer] = None
 ) -> Optional[str]:
     """
     Merge multiple video files into one using FFmpeg.
@@ -69,12 +626,16 @@ async def MergeVideo(
         user_id: User identifier for directory structure.
         message: Pyrogram Message object to update progress.
         format_: Output file extension (default: 'mp4').
+        normalizer: Optional ClipNormalizer whose finished segments are
+            reused if its reference has the profile picked here.
 
     Returns:
         Path to the merged video file or None if failed.
     """
     output_dir = f"{Config.DOWN_PATH}/{user_id}"
     output_file = os.path.join(output_dir, f"[@Savior_128]_Merged.{format_.lower()}")
+    priority = job_priority(user_id)
+    on_queued = _queue_notifier(message)
 
     # Validate input file
     if not os.path.exists(input_file):
@@ -88,20 +649,8 @@ async def MergeVideo(
             pass
         return None
 
-    # Check disk space
-    total, used, free = shutil.disk_usage(Config.DOWN_PATH)
-    if free < 2_000_000_000:  # Less than 2GB free
-        logger.error(f"Insufficient disk space: {free} bytes free")
-        try:
-            await message.edit_text(
-                "فضای دیسک کافی نیست! لطفاً حداقل 2 گیگابایت فضای ذخیره‌سازی آزاد کنید.",
-                parse_mode=ParseMode.MARKDOWN
-            )
-        except MessageNotModified:
-            pass
-        return None
-
-    # Check memory and CPU
+    # Disk space is reserved by the caller through disk_ledger before the job starts.
+    # Check memory; CPU load is handled by waiting for a scheduler slot
     memory = psutil.virtual_memory()
     if memory.available < 1_000_000_000:  # Less than 1GB free
         logger.error(f"Insufficient memory: {memory.available} bytes free")
@@ -113,17 +662,6 @@ async def MergeVideo(
         except MessageNotModified:
             pass
         return None
-    cpu_usage = psutil.cpu_percent()
-    if cpu_usage > 95:
-        logger.warning(f"High CPU usage: {cpu_usage}%")
-        try:
-            await message.edit_text(
-                "بار پردازشی سرور بسیار بالاست! لطفاً چند دقیقه صبر کنید و دوباره امتحان کنید.",
-                parse_mode=ParseMode.MARKDOWN
-            )
-        except MessageNotModified:
-            pass
-        return None
 
     # Ensure output directory exists and has write permissions
     try:
@@ -163,58 +701,18 @@ async def MergeVideo(
                 pass
             return None
 
-        # Get video info for first file to set reference resolution and frame rate
-        first_video_info = await get_video_info(video_files[0])
-        if not first_video_info:
-            logger.error(f"Invalid first video file: {video_files[0]}")
-            try:
-                await message.edit_text(
-                    f"فایل ویدیویی {video_files[0]} خراب یا نامعتبر است!",
-                    parse_mode=ParseMode.MARKDOWN
-                )
-            except MessageNotModified:
-                pass
-            return None
-
-        video_stream = next(
-            (stream for stream in first_video_info.get("streams", []) if stream.get("codec_type") == "video"),
-            None
-        )
-        if not video_stream:
-            logger.error(f"No video stream in {video_files[0]}")
-            try:
-                await message.edit_text(
-                    f"فایل {video_files[0]} جریان ویدیویی ندارد!",
-                    parse_mode=ParseMode.MARKDOWN
-                )
-            except MessageNotModified:
-                pass
-            return None
+        # Probe every input at once; the reference profile is chosen once all are known
+        semaphore = asyncio.Semaphore(Config.PROBE_CONCURRENCY)
 
-        width = video_stream.get("width", 720)
-        height = video_stream.get("height", 1280)
-        if not width or not height:
-            logger.error(f"Invalid resolution in {video_files[0]}")
-            try:
-                await message.edit_text(
-                    f"رزولوشن فایل {video_files[0]} نامعتبر است!",
-                    parse_mode=ParseMode.MARKDOWN
-                )
-            except MessageNotModified:
-                pass
-            return None
+        async def probe(video: str) -> Optional[Dict]:
+            if not os.path.exists(video):
+                return None
+            async with semaphore:
+                return await get_video_info(video)
 
-        # Parse frame rate safely
-        frame_rate_str = video_stream.get("r_frame_rate", "30/1")
-        try:
-            num, denom = map(int, frame_rate_str.split("/"))
-            frame_rate = num / denom if denom != 0 else 30
-        except (ValueError, ZeroDivisionError):
-            logger.warning(f"Invalid frame rate {frame_rate_str}, defaulting to 30")
-            frame_rate = 30
-
-        # Validate other video files
-        for video in video_files[1:]:
+        probed = await asyncio.gather(*(probe(video) for video in video_files))
+        video_infos = []
+        for video, video_info in zip(video_files, probed):
             if not os.path.exists(video):
                 logger.error(f"Video file {video} does not exist")
                 try:
@@ -225,7 +723,6 @@ async def MergeVideo(
                 except MessageNotModified:
                     pass
                 return None
-            video_info = await get_video_info(video)
             if not video_info:
                 logger.error(f"Invalid video file: {video}")
                 try:
@@ -236,6 +733,17 @@ async def MergeVideo(
                 except MessageNotModified:
                     pass
                 return None
+            if not _first_stream(video_info, "video"):
+                logger.error(f"No video stream in {video}")
+                try:
+                    await message.edit_text(
+                        f"فایل {video} جریان ویدیویی ندارد!",
+                        parse_mode=ParseMode.MARKDOWN
+                    )
+                except MessageNotModified:
+                    pass
+                return None
+            video_infos.append(video_info)
 
     except Exception as e:
         logger.error(f"Failed to read input file {input_file}: {e}")
@@ -248,43 +756,160 @@ async def MergeVideo(
             pass
         return None
 
-    # FFmpeg command with scale filter to unify resolution
-    file_generator_command = [
-        "ffmpeg",
-        "-f", "concat",
-        "-safe", "0",
-        "-i", input_file,
-        "-vf", f"scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,fps={frame_rate}",
-        "-c:v", "libx264",
-        "-preset", "fast",
-        "-c:a", "aac",
-        "-y",
-        output_file
-    ]
+    # Reference profile: the one shared by the most seconds of input
+    signatures = [_stream_signature(info) for info in video_infos]
+    total_duration = sum(_duration_of(info) for info in video_infos)
+    reference = _pick_reference(video_infos, signatures)
+    reference_info = video_infos[reference]
+    video_stream = _first_stream(reference_info, "video")
+
+    width = video_stream.get("width", 720)
+    height = video_stream.get("height", 1280)
+    if not width or not height:
+        logger.error(f"Invalid resolution in {video_files[reference]}")
+        try:
+            await message.edit_text(
+                f"رزولوشن فایل {video_files[reference]} نامعتبر است!",
+                parse_mode=ParseMode.MARKDOWN
+            )
+        except MessageNotModified:
+            pass
+        return None
+
+    frame_rate = _parse_frame_rate(video_stream)
+
+    # Target-size mode: if the output would not fit in Telegram, encode once at a fitting bitrate
+    video_bitrate = None
+    projected_size = sum(os.path.getsize(video) for video in video_files)
+    if exceeds_telegram_limit(projected_size) and total_duration > 0:
+        video_bitrate = _target_video_bitrate(total_duration)
+        logger.info(
+            f"Projected output {projected_size} bytes exceeds Telegram limit, "
+            f"encoding at {video_bitrate}k for {total_duration:.0f}s"
+        )
 
     try:
+        # Fast path: identical stream parameters can be joined without re-encoding
+        if video_bitrate is None and len(set(signatures)) == 1:
+            try:
+                await message.edit_text(
+                    "ویدیوها سازگار هستند، در حال ادغام بدون تبدیل...",
+                    parse_mode=ParseMode.MARKDOWN
+                )
+            except MessageNotModified:
+                pass
+            progress = _progress_reporter(message, "در حال ادغام بدون تبدیل ...", total_duration)
+            if await _concat_copy(input_file, output_file, progress, priority, on_queued):
+                return output_file
+
+        # Two-stage path: normalize only the odd clips, then join by copy
+        elif video_bitrate is None and _can_normalize_to(reference_info):
+            mismatched = [i for i, sig in enumerate(signatures) if sig != signatures[reference]]
+            try:
+                await message.edit_text(
+                    f"در حال یکسان‌سازی {len(mismatched)} ویدیو از {len(video_files)} ویدیو...",
+                    parse_mode=ParseMode.MARKDOWN
+                )
+            except MessageNotModified:
+                pass
+            segments_dir = os.path.join(output_dir, "normalized")
+            os.makedirs(segments_dir, exist_ok=True)
+            semaphore = asyncio.Semaphore(Config.NORMALIZE_WORKERS)
+            report = _progress_reporter(
+                message,
+                "در حال یکسان‌سازی ویدیوها ...",
+                sum(_duration_of(video_infos[i]) for i in mismatched)
+            )
+            normalized_seconds: Dict[int, float] = {}
+
+            # Early segments are only usable if they were normalized to the profile picked here
+            early_tasks = {}
+            if normalizer and normalizer.reference_info is not None:
+                if _stream_signature(normalizer.reference_info) == signatures[reference]:
+                    early_tasks = normalizer.tasks
+                else:
+                    # Unusable encodes would hold FFmpeg slots while the clips are normalized again
+                    normalizer.cancel()
+
+            async def normalize(index: int) -> Optional[str]:
+                early_task = early_tasks.get(video_files[index])
+                if early_task is not None and not early_task.cancelled():
+                    return await early_task
+
+                async def clip_progress(done: float) -> None:
+                    normalized_seconds[index] = done
+                    await report(sum(normalized_seconds.values()))
+
+                async with semaphore:
+                    return await normalize_clip(
+                        video_file=video_files[index],
+                        video_info=video_infos[index],
+                        reference_info=reference_info,
+                        output_file=os.path.join(segments_dir, f"{index}.{format_.lower()}"),
+                        progress=clip_progress if report else None,
+                        priority=priority,
+                        on_queued=on_queued
+                    )
+
+            normalized = await asyncio.gather(*(normalize(i) for i in mismatched))
+            if all(normalized):
+                segments = list(video_files)
+                for index, segment in zip(mismatched, normalized):
+                    segments[index] = segment
+                segments_list = os.path.join(segments_dir, "concat.txt")
+                with open(segments_list, "w") as f:
+                    f.write("\n".join(f"file '{os.path.abspath(path)}'" for path in segments))
+                try:
+                    await message.edit_text(
+                        "در حال ادغام ویدیوهای یکسان‌سازی‌شده...",
+                        parse_mode=ParseMode.MARKDOWN
+                    )
+                except MessageNotModified:
+                    pass
+                progress = _progress_reporter(message, "در حال ادغام بدون تبدیل ...", total_duration)
+                if await _concat_copy(segments_list, output_file, progress, priority, on_queued):
+                    return output_file
+            else:
+                logger.warning("Normalization failed for some clips, falling back to re-encode")
+
+    except FileNotFoundError:
+        logger.error("FFmpeg executable not found")
         try:
-            if message.text != "در حال ادغام ویدیوها...\nلطفاً صبور باشید...":
+            await message.edit_text(
+                "اجرای FFmpeg یافت نشد! لطفاً مطمئن شوید که FFmpeg نصب شده است.",
+                parse_mode=ParseMode.MARKDOWN
+            )
+        except MessageNotModified:
+            pass
+        return None
+    except Exception as e:
+        logger.warning(f"Copy-based merge failed, falling back to re-encode: {e}")
+
+    if normalizer:
+        # The single-pass re-encode reads the original clips, so early segments are not needed
+        normalizer.cancel()
+    file_generator_command = _reencode_command(input_file, output_file, width, height, frame_rate, video_bitrate)
+
+    try:
+        status_text = "در حال ادغام ویدیوها...\nلطفاً صبور باشید..."
+        if video_bitrate is not None:
+            status_text = (
+                "حجم خروجی از محدودیت تلگرام بیشتر می‌شود!\n"
+                f"در حال ادغام با بیت‌ریت {video_bitrate}kbps تا فایل در تلگرام آپلود شود..."
+            )
+        try:
+            if message.text != status_text:
                 await message.edit_text(
-                    "در حال ادغام ویدیوها...\nلطفاً صبور باشید...",
+                    status_text,
                     parse_mode=ParseMode.MARKDOWN
                 )
         except MessageNotModified:
             pass
 
-        logger.info(f"Executing FFmpeg command: {' '.join(file_generator_command)}")
-        process = await asyncio.create_subprocess_exec(
-            *file_generator_command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await process.communicate()  # Removed timeout for Python 3.10 compatibility
-        stdout_str = stdout.decode("utf-8").strip()
-        stderr_str = stderr.decode("utf-8").strip()
-        logger.debug(f"FFmpeg stdout: {stdout_str}")
-        logger.debug(f"FFmpeg stderr: {stderr_str}")
+        progress = _progress_reporter(message, "در حال ادغام ویدیوها ...", total_duration)
+        returncode, stderr_str = await _run_ffmpeg(file_generator_command, progress, priority, on_queued)
 
-        if process.returncode != 0:
+        if returncode != 0:
             logger.error(f"FFmpeg failed with error: {stderr_str}")
             try:
                 await message.edit_text(
@@ -331,22 +956,120 @@ async def MergeVideo(
             pass
         return None
 
+async def MergePipedVideo(
+    input_file: str,
+    video_infos: List[Dict],
+    projected_size: int,
+    feed: Callable[[], Awaitable[None]],
+    user_id: str,
+    message: Message,
+    format_: str = "mp4"
+) -> Optional[str]:
+    """
+    Merge inputs that arrive through named pipes, reading each one only once.
+
+    The concat list points at FIFOs that `feed` fills in list order while
+    FFmpeg runs. Since the inputs cannot be read twice there is no
+    normalization stage and no fallback: identical profiles are joined by
+    stream copy, anything else is re-encoded in a single pass.
+
+    Args:
+        input_file: Path to the concat list of pipe paths.
+        video_infos: ffprobe results of the inputs, in list order.
+        projected_size: Summed size of the inputs in bytes.
+        feed: Coroutine writing every input into its pipe, in order.
+        user_id: User identifier for directory structure.
+        message: Pyrogram Message object to update progress.
+        format_: Output file extension (default: 'mp4').
+
+    Returns:
+        Path to the merged video file or None if failed.
+    """
+    output_dir = f"{Config.DOWN_PATH}/{user_id}"
+    output_file = os.path.join(output_dir, f"[@Savior_128]_Merged.{format_.lower()}")
+    priority = job_priority(user_id)
+
+    signatures = [_stream_signature(info) for info in video_infos]
+    total_duration = sum(_duration_of(info) for info in video_infos)
+    reference_stream = _first_stream(video_infos[_pick_reference(video_infos, signatures)], "video")
+    if not reference_stream or not reference_stream.get("width") or not reference_stream.get("height"):
+        logger.error("No usable video stream in piped inputs")
+        return None
+
+    video_bitrate = None
+    if exceeds_telegram_limit(projected_size) and total_duration > 0:
+        video_bitrate = _target_video_bitrate(total_duration)
+    if video_bitrate is None and len(set(signatures)) == 1:
+        command = _copy_command(input_file, output_file)
+        status_text = "در حال ادغام بدون تبدیل ..."
+    else:
+        command = _reencode_command(
+            input_file,
+            output_file,
+            reference_stream["width"],
+            reference_stream["height"],
+            _parse_frame_rate(reference_stream),
+            video_bitrate
+        )
+        status_text = "در حال ادغام ویدیوها ..."
+
+    progress = _progress_reporter(message, status_text, total_duration)
+    feeder = asyncio.create_task(feed())
+    merger = asyncio.create_task(_run_ffmpeg(command, progress, priority, _queue_notifier(message)))
+    try:
+        # A feeder failure leaves FFmpeg blocked on the next pipe, so it must stop the merge;
+        # FFmpeg exiting first leaves the feeder waiting for a pipe nobody opens, so it is cancelled
+        done, _ = await asyncio.wait({feeder, merger}, return_when=asyncio.FIRST_COMPLETED)
+        if feeder in done and feeder.exception():
+            logger.error(f"Pipe feeder failed: {feeder.exception()}")
+            merger.cancel()
+            return None
+        returncode, stderr_str = await merger
+    except FileNotFoundError:
+        logger.error("FFmpeg executable not found")
+        return None
+    except Exception as e:
+        logger.error(f"Piped merge failed: {e}")
+        return None
+    finally:
+        for task in (feeder, merger):
+            if not task.done():
+                task.cancel()
+
+    if returncode == 0 and os.path.exists(output_file) and os.path.getsize(output_file) > 0:
+        logger.info(f"Merged video created from pipes: {output_file}, Size: {os.path.getsize(output_file)} bytes")
+        return output_file
+    logger.error(f"Piped merge failed: {stderr_str}")
+    return None
+
 async def cult_small_video(
     video_file: str,
     output_directory: str,
     start_time: int,
     end_time: int,
-    format_: str
+    format_: str,
+    message: Optional[Message] = None,
+    video_info: Optional[Dict] = None,
+    accurate: Optional[bool] = None,
+    priority: int = PRIORITY_NORMAL
 ) -> Optional[str]:
     """
     Create a short sample video clip.
 
+    By default the input is seeked before decoding and the streams are
+    copied, so the clip starts at the keyframe nearest before start_time.
+    The accurate mode re-encodes from the exact start time instead.
+
     Args:
         video_file: Path to input video.
         output_directory: Directory to save the output file.
         start_time: Start time for the clip in seconds.
         end_time: End time for the clip in seconds.
         format_: File extension (e.g., 'mp4', 'mkv').
+        message: Optional status message to show encode progress on.
+        video_info: ffprobe result of video_file if the caller already has it.
+        accurate: Re-encode for a frame-exact cut (default: Config.SAMPLE_ACCURATE).
+        priority: Scheduling priority of the job.
 
     Returns:
         Path to the sample video or None if failed.
@@ -354,45 +1077,48 @@ async def cult_small_video(
     if start_time >= end_time or start_time < 0:
         logger.error(f"Invalid time range: start_time={start_time}, end_time={end_time}")
         return None
+    if accurate is None:
+        accurate = Config.SAMPLE_ACCURATE
 
     os.makedirs(output_directory, exist_ok=True)
     output_file = os.path.join(output_directory, f"{round(time.time())}.{format_.lower()}")
 
     file_generator_command = [
         "ffmpeg",
-        "-i", video_file,
         "-ss", str(start_time),
-        "-to", str(end_time),
-        "-c:v", "libx264",
-        "-preset", "fast",
-        "-c:a", "aac",
-        "-y",
-        output_file
+        "-i", video_file,
+        "-t", str(end_time - start_time)
     ]
+    if accurate:
+        file_generator_command += [
+            "-c:v", "libx264",
+            "-preset", "fast",
+            "-c:a", "aac"
+        ]
+    else:
+        file_generator_command += [
+            "-c", "copy",
+            "-avoid_negative_ts", "make_zero"
+        ]
+    file_generator_command += _output_flags(output_file) + ["-y", output_file]
 
     try:
-        video_info = await get_video_info(video_file)
+        if video_info is None:
+            video_info = await get_video_info(video_file)
         if not video_info:
             logger.error(f"Invalid video file: {video_file}")
             return None
 
         # Validate time range against video duration
-        duration = float(video_info.get("format", {}).get("duration", 0))
+        duration = _duration_of(video_info)
         if end_time > duration:
             logger.error(f"End time {end_time} exceeds video duration {duration}")
             return None
 
-        logger.info(f"Executing FFmpeg command: {' '.join(file_generator_command)}")
-        process = await asyncio.create_subprocess_exec(
-            *file_generator_command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+        progress = _progress_reporter(message, "در حال تولید ویدیوی نمونه ...", end_time - start_time)
+        returncode, stderr_str = await _run_ffmpeg(
+            file_generator_command, progress, priority, _queue_notifier(message)
         )
-        stdout, stderr = await process.communicate()  # Removed timeout for Python 3.10 compatibility
-        stdout_str = stdout.decode("utf-8").strip()
-        stderr_str = stderr.decode("utf-8").strip()
-        logger.debug(f"FFmpeg stdout: {stdout_str}")
-        logger.debug(f"FFmpeg stderr: {stderr_str}")
 
         if os.path.exists(output_file) and os.path.getsize(output_file) > 0:
             logger.info(f"Sample video created: {output_file}, Size: {os.path.getsize(output_file)} bytes")
@@ -413,7 +1139,9 @@ async def generate_screen_shots(
     video_file: str,
     output_directory: str,
     no_of_photos: int,
-    duration: int
+    duration: int,
+    video_info: Optional[Dict] = None,
+    priority: int = PRIORITY_NORMAL
 ) -> List[str]:
     """
     Generate screenshots from a video.
@@ -423,6 +1151,8 @@ async def generate_screen_shots(
         output_directory: Directory to save screenshots.
         no_of_photos: Number of screenshots to generate.
         duration: Duration of the video in seconds.
+        video_info: ffprobe result of video_file if the caller already has it.
+        priority: Scheduling priority of the job.
 
     Returns:
         List of screenshot file paths.
@@ -434,48 +1164,84 @@ async def generate_screen_shots(
 
     os.makedirs(output_directory, exist_ok=True)
     ttl_step = duration // no_of_photos
-    current_ttl = ttl_step
 
-    video_info = await get_video_info(video_file)
+    if video_info is None:
+        video_info = await get_video_info(video_file)
     if not video_info:
         logger.error(f"Invalid video file: {video_file}")
         return images
 
-    for _ in range(no_of_photos):
-        await asyncio.sleep(1)
-        video_thumbnail = os.path.join(output_directory, f"{round(time.time())}.jpg")
-        file_generator_command = [
-            "ffmpeg",
-            "-ss", str(round(current_ttl)),
-            "-i", video_file,
-            "-vframes", "1",
-            "-y",
-            video_thumbnail
-        ]
+    # One process: every timestamp is a fast input seek feeding its own output
+    batch = uuid.uuid4().hex[:8]
+    file_generator_command = ["ffmpeg", "-y"]
+    for index in range(no_of_photos):
+        file_generator_command += ["-ss", str(round(ttl_step * (index + 1))), "-i", video_file]
+    screenshots = []
+    for index in range(no_of_photos):
+        video_thumbnail = os.path.join(output_directory, f"ss_{batch}_{index + 1:02d}.jpg")
+        file_generator_command += ["-map", f"{index}:v:0", "-frames:v", "1", video_thumbnail]
+        screenshots.append(video_thumbnail)
 
-        try:
-            logger.info(f"Executing FFmpeg command: {' '.join(file_generator_command)}")
-            process = await asyncio.create_subprocess_exec(
-                *file_generator_command,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await process.communicate()  # Removed timeout for Python 3.10 compatibility
-            stdout_str = stdout.decode("utf-8").strip()
-            stderr_str = stderr.decode("utf-8").strip()
-            logger.debug(f"FFmpeg stdout: {stdout_str}")
-            logger.debug(f"FFmpeg stderr: {stderr_str}")
+    try:
+        returncode, stderr_str = await _run_ffmpeg(file_generator_command, priority=priority)
+        if returncode != 0:
+            logger.error(f"Failed to generate screenshots: {stderr_str}")
 
-            if os.path.exists(video_thumbnail) and os.path.getsize(video_thumbnail) > 0:
-                images.append(video_thumbnail)
-            current_ttl += ttl_step
+    except FileNotFoundError:
+        logger.error("FFmpeg executable not found")
+        return images
 
-        except FileNotFoundError:
-            logger.error("FFmpeg executable not found")
-            continue
+    except Exception as e:
+        logger.error(f"Failed to generate screenshots: {e}")
+        return images
+
+    for video_thumbnail in screenshots:
+        if os.path.exists(video_thumbnail) and os.path.getsize(video_thumbnail) > 0:
+            images.append(video_thumbnail)
+    return images
 
-        except Exception as e:
-            logger.error(f"Failed to generate screenshot: {e}")
-            continue
+async def generate_thumbnail(
+    video_file: str,
+    output_file: str,
+    seek: int,
+    priority: int = PRIORITY_NORMAL,
+    max_side: Optional[int] = None
+) -> Optional[str]:
+    """
+    Grab a single frame of a video as a thumbnail.
 
-    return images
\ No newline at end of file
+    Args:
+        video_file: Path to input video.
+        output_file: Path of the JPEG to write.
+        seek: Position of the frame in seconds.
+        priority: Scheduling priority of the job.
+        max_side: Scale the frame down to fit a box of this size, if given.
+
+    Returns:
+        Path to the thumbnail or None if failed.
+    """
+    file_generator_command = [
+        "ffmpeg",
+        "-ss", str(seek),
+        "-i", video_file,
+        "-vframes", "1"
+    ]
+    if max_side:
+        file_generator_command += [
+            "-vf", f"scale='min({max_side},iw)':'min({max_side},ih)':force_original_aspect_ratio=decrease"
+        ]
+    file_generator_command += ["-y", output_file]
+    try:
+        returncode, stderr_str = await _run_ffmpeg(file_generator_command, priority=priority)
+        if os.path.exists(output_file) and os.path.getsize(output_file) > 0:
+            return output_file
+        logger.error(f"Failed to generate thumbnail: {stderr_str}")
+        return None
+
+    except FileNotFoundError:
+        logger.error("FFmpeg executable not found")
+        return None
+
+    except Exception as e:
+        logger.error(f"Failed to generate thumbnail: {e}")
+        return None
@@ -0,0 +1,177 @@
+# (c) @Savior_128
+
+import os
+import time
+import shutil
+import asyncio
+import logging
+from typing import Callable, List, Tuple
+from configs import Config
+from helpers.disk_ledger import disk_ledger
+from helpers.display_progress import humanbytes
+
+logger = logging.getLogger(__name__)
+
+
+def _scan_entry(path: str) -> Tuple[int, float]:
+    """Total size and newest modification time of a file or directory tree."""
+    if not os.path.isdir(path):
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime
+    size = 0
+    newest = os.stat(path).st_mtime
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                stat = os.stat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            size += stat.st_size
+            newest = max(newest, stat.st_mtime)
+    return size, newest
+
+
+def _remove(path: str) -> None:
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        os.remove(path)
+
+
+class ScratchJanitor:
+    """
+    Background cleaner for DOWN_PATH.
+
+    Entries of users without a running job are removed once they have not
+    been touched for `max_age` seconds, and earlier, least recently used
+    first, while the disk is fuller than `high_water` percent. Jobs that
+    have held a disk reservation for longer than `max_age` are treated as
+    abandoned and cleaned up as well, unless their merge is still running
+    or their directory was written to within `max_age`.
+    """
+
+    def __init__(self, root: str, max_age: int, high_water: float, interval: int):
+        self.root = root
+        self.max_age = max_age
+        self.high_water = high_water
+        self.interval = max(1, interval)
+        self.reclaimed_bytes = 0
+        self.removed_entries = 0
+        self.last_run = None
+        self.running: set = set()
+
+    def attach(self, running: set) -> None:
+        """Track the bot's set of users whose merge is running."""
+        self.running = running
+
+    def _job_alive(self, job, now: float) -> bool:
+        if job in self.running:
+            return True
+        try:
+            _, newest = _scan_entry(os.path.join(self.root, str(job)))
+        except OSError:
+            return False
+        return now - newest <= self.max_age
+
+    def active_users(self) -> set:
+        """User directories in use, after releasing jobs that were abandoned."""
+        now = time.time()
+        active = set()
+        for job, started in disk_ledger.active_jobs().items():
+            if now - started > self.max_age and not self._job_alive(job, now):
+                logger.info(f"Releasing abandoned job of user {job}")
+                disk_ledger.release(job)
+            else:
+                active.add(str(job))
+        return active
+
+    def is_active(self, name: str) -> bool:
+        """
+        Check whether a DOWN_PATH entry belongs to a job holding a reservation or running a merge.
+
+        Reads the live state, so sweep() can call it from its worker thread
+        right before removing anything.
+        """
+        # Both are copied first, in one step, so the loop changing them meanwhile is harmless
+        jobs, running = disk_ledger.active_jobs(), set(self.running)
+        return name in {str(job) for job in jobs} or name in {str(user) for user in running}
+
+    def _disk_percent(self) -> float:
+        usage = shutil.disk_usage(self.root)
+        return usage.used * 100 / usage.total if usage.total else 0.0
+
+    def sweep(self, is_active: Callable[[str], bool]) -> int:
+        """
+        Run one cleaning pass. Blocking; call it from a worker thread.
+
+        Args:
+            is_active: Called with an entry name; True if it belongs to a
+                running job. Checked again right before each removal, since
+                jobs can start while the pass runs.
+
+        Returns:
+            int: Bytes reclaimed in this pass.
+        """
+        if not os.path.isdir(self.root):
+            return 0
+        now = time.time()
+        candidates: List[Tuple[float, int, str]] = []
+        for name in os.listdir(self.root):
+            if is_active(name):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                size, newest = _scan_entry(path)
+            except OSError:
+                continue
+            candidates.append((newest, size, path))
+
+        reclaimed = 0
+        candidates.sort()
+        for newest, size, path in candidates:
+            if now - newest <= self.max_age and self._disk_percent() <= self.high_water:
+                # Entries are sorted oldest first, so the rest are fresher still
+                break
+            if is_active(os.path.basename(path)):
+                continue
+            try:
+                _remove(path)
+            except OSError as e:
+                logger.warning(f"Failed to remove {path}: {e}")
+                continue
+            logger.info(f"Removed stale scratch entry {path} ({humanbytes(size)})")
+            reclaimed += size
+            self.removed_entries += 1
+        self.reclaimed_bytes += reclaimed
+        self.last_run = now
+        return reclaimed
+
+    async def run(self) -> None:
+        """Sweep DOWN_PATH every `interval` seconds until cancelled."""
+        while True:
+            try:
+                # Releases abandoned jobs on the loop; the sweep then reads the live state
+                self.active_users()
+                await asyncio.to_thread(self.sweep, self.is_active)
+            except Exception as e:
+                logger.error(f"Scratch janitor failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def report(self) -> str:
+        """Describe the janitor's work for the owner."""
+        if self.last_run is None:
+            last_run = "هنوز اجرا نشده"
+        else:
+            last_run = f"{int(time.time() - self.last_run)} ثانیه پیش"
+        return (
+            f"**پاک‌سازی فضای موقت:** {humanbytes(self.reclaimed_bytes) or '0 B'} آزاد شد "
+            f"({self.removed_entries} مورد، آخرین اجرا: {last_run})"
+        )
+
+
+janitor = ScratchJanitor(
+    root=Config.DOWN_PATH,
+    max_age=Config.SCRATCH_MAX_AGE,
+    high_water=Config.SCRATCH_HIGH_WATER,
+    interval=Config.SCRATCH_SCAN_INTERVAL
+)
@@ -0,0 +1,112 @@
+# (c) @Savior_128
+
+import os
+import json
+import asyncio
+import logging
+from typing import Dict, List, Optional
+from configs import Config
+
+logger = logging.getLogger(__name__)
+
+# Job stages worth resuming after a restart
+STAGE_MERGING = "merging"
+STAGE_MERGED = "merged"
+
+
+class JobStore:
+    """
+    Local JSON checkpoint of user queues and merge jobs.
+
+    The store holds references to the bot's in-memory queue dicts and
+    writes them, together with the stage of every running merge, to
+    `path` whenever they changed. After a restart the dicts are filled
+    again from the file and interrupted merges can be picked up:
+    downloads survive in the download cache and finished merges in
+    DOWN_PATH, so a resumed job starts from the last finished stage.
+    """
+
+    def __init__(self, path: str, interval: float):
+        self.path = path
+        self.interval = interval
+        self.queues: Dict[int, List[int]] = {}
+        self.formats: Dict[int, Optional[str]] = {}
+        self.replies: Dict[int, int] = {}
+        self.jobs: Dict[int, Dict] = {}
+        self._last_written: Optional[str] = None
+        self._lock = asyncio.Lock()
+
+    def attach(self, queues: Dict, formats: Dict, replies: Dict) -> None:
+        """Restore the saved state into the bot's queue dicts and track them from now on."""
+        self.queues, self.formats, self.replies = queues, formats, replies
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                state = json.load(f)
+        except Exception as e:
+            logger.warning(f"Failed to load job store {self.path}: {e}")
+            return
+        queues.update({int(k): v for k, v in state.get("queues", {}).items()})
+        formats.update({int(k): v for k, v in state.get("formats", {}).items()})
+        replies.update({int(k): v for k, v in state.get("replies", {}).items()})
+        self.jobs.update({int(k): v for k, v in state.get("jobs", {}).items()})
+        logger.info(f"Restored {len(queues)} queues and {len(self.jobs)} interrupted jobs")
+
+    def start(self, user_id: int, chat_id: int, message_id: int) -> None:
+        """Record that a user's merge started, with the message showing its status."""
+        self.jobs[int(user_id)] = {
+            "stage": STAGE_MERGING,
+            "chat_id": chat_id,
+            "message_id": message_id,
+            "output": None
+        }
+
+    def set_stage(self, user_id: int, stage: str, output: Optional[str] = None) -> None:
+        job = self.jobs.get(int(user_id))
+        if job is not None:
+            job["stage"] = stage
+            if output is not None:
+                job["output"] = output
+
+    def finish(self, user_id: int) -> None:
+        self.jobs.pop(int(user_id), None)
+
+    def _snapshot(self) -> str:
+        # A job ends with its queue being cleared, on every exit path
+        for user_id in [uid for uid in self.jobs if not self.queues.get(uid)]:
+            del self.jobs[user_id]
+        return json.dumps({
+            "queues": {str(k): v for k, v in self.queues.items() if v},
+            "formats": {str(k): v for k, v in self.formats.items() if v and self.queues.get(k)},
+            "replies": {str(k): v for k, v in self.replies.items() if self.queues.get(k)},
+            "jobs": {str(k): v for k, v in self.jobs.items()}
+        })
+
+    def _write(self, data: str) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    async def save(self) -> None:
+        """Write the current state if it changed since the last write."""
+        async with self._lock:
+            data = self._snapshot()
+            if data == self._last_written:
+                return
+            try:
+                await asyncio.to_thread(self._write, data)
+                self._last_written = data
+            except Exception as e:
+                logger.warning(f"Failed to save job store {self.path}: {e}")
+
+    async def run(self) -> None:
+        """Checkpoint every `interval` seconds until cancelled."""
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.save()
+
+
+job_store = JobStore(os.path.join(Config.CACHE_PATH, "jobs.json"), Config.CHECKPOINT_INTERVAL)
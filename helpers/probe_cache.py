@@ -0,0 +1,132 @@
+# (c) @Savior_128
+
+import os
+import json
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional
+from configs import Config
+
+logger = logging.getLogger(__name__)
+
+
+class ProbeCache:
+    """
+    LRU cache of ffprobe results.
+
+    Entries are keyed by file identity (real path + size + mtime), so a file
+    that changes on disk is probed again, and optionally by Telegram
+    file_unique_id, so the same media downloaded to another path is not
+    probed twice. When persisted, new results are written to `path` every
+    `interval` seconds and at shutdown, not after every probe.
+    """
+
+    def __init__(self, max_entries: int, path: Optional[str] = None, interval: float = 60):
+        self.max_entries = max(1, max_entries)
+        self.path = path
+        self.interval = max(1, interval)
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._save_lock = asyncio.Lock()
+        self._load()
+        self._dirty = False
+
+    @staticmethod
+    def _file_key(video_file: str) -> Optional[str]:
+        try:
+            stat = os.stat(video_file)
+        except OSError:
+            return None
+        return f"file:{os.path.realpath(video_file)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def _touch(self, key: str) -> Optional[Dict]:
+        info = self._entries.get(key)
+        if info is not None:
+            self._entries.move_to_end(key)
+        return info
+
+    def get(self, video_file: str, file_unique_id: Optional[str] = None) -> Optional[Dict]:
+        """
+        Look up a cached ffprobe result.
+
+        Args:
+            video_file: Path to the media file.
+            file_unique_id: Telegram file_unique_id of the media, if known.
+
+        Returns:
+            dict: Cached ffprobe result, or None on a miss.
+        """
+        file_key = self._file_key(video_file)
+        info = self._touch(file_key) if file_key else None
+        if info is None and file_unique_id:
+            info = self._touch(f"tg:{file_unique_id}")
+            if info is not None and file_key:
+                self._store(file_key, info)
+        return info
+
+    def put(self, video_file: str, info: Dict, file_unique_id: Optional[str] = None) -> None:
+        """
+        Store an ffprobe result under every known identity of the file.
+
+        Args:
+            video_file: Path to the probed file.
+            info: ffprobe result.
+            file_unique_id: Telegram file_unique_id of the media, if known.
+        """
+        file_key = self._file_key(video_file)
+        if file_key:
+            self._store(file_key, info)
+        if file_unique_id:
+            self._store(f"tg:{file_unique_id}", info)
+
+    def _store(self, key: str, info: Dict) -> None:
+        self._entries[key] = info
+        self._dirty = True
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                for key, info in json.load(f):
+                    self._store(key, info)
+            logger.info(f"Loaded {len(self._entries)} cached probe results from {self.path}")
+        except Exception as e:
+            logger.warning(f"Failed to load probe cache {self.path}: {e}")
+
+    async def save(self) -> None:
+        """Write the cache to disk in a worker thread, if persistence is enabled and it changed."""
+        if not self.path or not self._dirty:
+            return
+        async with self._save_lock:
+            self._dirty = False
+            if not await asyncio.to_thread(self._write, list(self._entries.items())):
+                self._dirty = True
+
+    async def run(self) -> None:
+        """Save new results every `interval` seconds until cancelled."""
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.save()
+
+    def _write(self, entries: list) -> bool:
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to save probe cache {self.path}: {e}")
+            return False
+
+
+probe_cache = ProbeCache(
+    max_entries=Config.PROBE_CACHE_SIZE,
+    path=os.path.join(Config.CACHE_PATH, "probe_cache.json") if Config.PROBE_CACHE_PERSIST else None,
+    interval=Config.PROBE_CACHE_SAVE_INTERVAL
+)
@@ -0,0 +1,166 @@
+# (c) @Savior_128
+
+import os
+import math
+import heapq
+import asyncio
+import logging
+import itertools
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from configs import Config
+
+logger = logging.getLogger(__name__)
+
+# Lower value runs first; equal priorities run in arrival order
+PRIORITY_OWNER = 0
+PRIORITY_NORMAL = 1
+
+QueueCallback = Callable[[int], Awaitable[None]]
+
+
+def available_cores() -> int:
+    """Number of CPU cores FFmpeg may use, honouring FFMPEG_CORES and CPU affinity."""
+    if Config.FFMPEG_CORES > 0:
+        return Config.FFMPEG_CORES
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def job_priority(user_id: int) -> int:
+    """
+    Get the scheduling priority for a user's FFmpeg jobs.
+
+    Args:
+        user_id: Telegram User ID.
+
+    Returns:
+        int: PRIORITY_OWNER for the bot owner, PRIORITY_NORMAL otherwise.
+    """
+    return PRIORITY_OWNER if int(user_id) == Config.BOT_OWNER else PRIORITY_NORMAL
+
+
+class JobScheduler:
+    """
+    Process-wide admission control for FFmpeg processes.
+
+    At most `slots` processes run at once. Others wait in a priority FIFO
+    and are told their queue position while they wait. The cores form a
+    thread budget: each admitted process gets an equal share among the
+    running and queued jobs, but never more than is left unallocated, and
+    returns its threads when it finishes. A job running alone gets every
+    core, and jobs admitted after others finish get larger shares, while
+    the total stays within the cores.
+    """
+
+    def __init__(self, slots: int, cores: int):
+        self.slots = max(1, slots)
+        self.cores = max(1, cores)
+        self.running = 0
+        self.allocated = 0
+        self._waiting: List[Tuple[int, int, asyncio.Future, Optional[QueueCallback]]] = []
+        self._counter = itertools.count()
+        self._allocations: Dict[int, Tuple[str, int]] = {}
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for _, _, future, _ in self._waiting if not future.done())
+
+    def _positions(self) -> List[Tuple[int, Optional[QueueCallback]]]:
+        live = sorted(entry for entry in self._waiting if not entry[2].done())
+        return [(position, entry[3]) for position, entry in enumerate(live, start=1)]
+
+    def _notify_positions(self) -> None:
+        for position, on_queued in self._positions():
+            if on_queued is not None:
+                asyncio.create_task(self._safe_notify(on_queued, position))
+
+    @staticmethod
+    async def _safe_notify(on_queued: QueueCallback, position: int) -> None:
+        try:
+            await on_queued(position)
+        except Exception as e:
+            logger.debug(f"Queue position update failed: {e}")
+
+    async def acquire(self, priority: int = PRIORITY_NORMAL, on_queued: Optional[QueueCallback] = None) -> None:
+        """
+        Wait for a free slot.
+
+        Args:
+            priority: PRIORITY_OWNER or PRIORITY_NORMAL.
+            on_queued: Optional coroutine called with the queue position
+                whenever the job has to wait or moves up in the queue.
+        """
+        if self.running < self.slots and not self.queued:
+            self.running += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._counter), future, on_queued)
+        heapq.heappush(self._waiting, entry)
+        self._notify_positions()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Slot was granted just before cancellation; hand it on
+                self.release()
+            else:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+            raise
+
+    def release(self) -> None:
+        """Free a slot and start the next waiting job, if any."""
+        self.running -= 1
+        while self._waiting:
+            _, _, future, _ = heapq.heappop(self._waiting)
+            if not future.done():
+                self.running += 1
+                future.set_result(None)
+                break
+        self._notify_positions()
+
+    def threads_for_new_job(self) -> int:
+        """Thread count for a process admitted now, counting it among the running ones."""
+        share = math.ceil(self.cores / max(1, self.running + self.queued))
+        return max(1, min(self.cores - self.allocated, share))
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        priority: int = PRIORITY_NORMAL,
+        on_queued: Optional[QueueCallback] = None,
+        label: str = "ffmpeg"
+    ) -> AsyncIterator[int]:
+        """
+        Context manager around acquire() and release().
+
+        Yields:
+            int: Number of threads the admitted process should use.
+        """
+        await self.acquire(priority, on_queued)
+        job_id = next(self._counter)
+        threads = self.threads_for_new_job()
+        self._allocations[job_id] = (label, threads)
+        self.allocated += threads
+        try:
+            yield threads
+        finally:
+            self.allocated -= threads
+            del self._allocations[job_id]
+            self.release()
+
+    def allocation_report(self) -> str:
+        """Describe the current slot and thread allocation for the owner."""
+        lines = [
+            f"**اسلات‌های FFmpeg:** {self.running}/{self.slots} (در صف: {self.queued})",
+            f"**هسته‌های CPU:** {self.allocated}/{self.cores} رشته در حال استفاده"
+        ]
+        for label, threads in self._allocations.values():
+            lines.append(f"  • `{label}`: {threads} رشته")
+        return "\n".join(lines)
+
+
+scheduler = JobScheduler(Config.FFMPEG_SLOTS, available_cores())
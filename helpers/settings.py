@@ -18,9 +18,10 @@ async def OpenSettings(m: Message, user_id: int) -> None:
         Exception: If an unexpected error occurs during message editing.
     """
     try:
-        upload_as_doc = await db.get_upload_as_doc(id=user_id)
-        generate_sample = await db.get_generate_sample_video(id=user_id)
-        generate_ss = await db.get_generate_ss(id=user_id)
+        settings = await db.get_settings(id=user_id)
+        upload_as_doc = settings['upload_as_doc']
+        generate_sample = settings['generate_sample_video']
+        generate_ss = settings['generate_ss']
         
         await m.edit_text(
             text="Here You Can Change or Configure Your Settings:",
@@ -0,0 +1,185 @@
+# (c) @Savior_128
+
+import os
+import errno
+import asyncio
+import logging
+from typing import Dict, List, Optional
+from configs import Config
+from pyrogram import Client
+from pyrogram.types import Message
+from helpers.ffmpeg import get_video_info, MergePipedVideo
+
+logger = logging.getLogger(__name__)
+
+# stream_media yields 1 MiB chunks; this much of the head is enough to probe a clip
+HEAD_CHUNKS = 2
+# Seconds between attempts to open a pipe FFmpeg has not opened for reading yet
+PIPE_OPEN_POLL = 0.2
+
+
+def _moov_before_mdat(head: bytes) -> bool:
+    """
+    Check whether an MP4 head has its index (moov) before the media data (mdat).
+
+    Only such files can be demuxed from a pipe without seeking.
+
+    Args:
+        head: First bytes of the file.
+
+    Returns:
+        bool: True if a moov box starts before any mdat box.
+    """
+    offset = 0
+    while offset + 8 <= len(head):
+        size = int.from_bytes(head[offset:offset + 4], "big")
+        box = head[offset + 4:offset + 8]
+        if box == b"moov":
+            return True
+        if box == b"mdat":
+            return False
+        if size == 1 and offset + 16 <= len(head):
+            size = int.from_bytes(head[offset + 8:offset + 16], "big")
+        if size < 8:
+            return False
+        offset += size
+    return False
+
+
+async def probe_stream_head(bot: Client, msg: Message, head_path: str) -> Optional[Dict]:
+    """
+    Probe a queued video from its first bytes, if it can be read sequentially.
+
+    Args:
+        bot: Pyrogram Client instance.
+        msg: Message holding the video.
+        head_path: Temporary file to store the head in.
+
+    Returns:
+        dict: ffprobe result, or None if the clip needs to be downloaded first.
+    """
+    media = msg.video or msg.document
+    ext = head_path.rsplit(".", 1)[-1].lower()
+    head = b""
+    async for chunk in bot.stream_media(msg, limit=HEAD_CHUNKS):
+        head += chunk
+    if ext in ("mp4", "mov") and not _moov_before_mdat(head):
+        logger.info(f"{media.file_name} keeps its index at the end, cannot be streamed")
+        return None
+    with open(head_path, "wb") as f:
+        f.write(head)
+    try:
+        # The head file is removed right away, so its probe is not cached
+        video_info = await get_video_info(head_path, cache=False)
+    finally:
+        os.remove(head_path)
+    if not video_info:
+        return None
+    video_info = dict(video_info)
+    video_format = dict(video_info.get("format", {}))
+    try:
+        header_duration = float(video_format.get("duration", 0))
+    except (TypeError, ValueError):
+        header_duration = 0.0
+    if header_duration <= 0:
+        video_format["duration"] = str(getattr(media, "duration", None) or 0)
+    video_info["format"] = video_format
+    return video_info
+
+
+async def _open_pipe_writer(path: str) -> asyncio.StreamWriter:
+    """Wait until FFmpeg opens a pipe for reading, then return a writer for it."""
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+            break
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+            await asyncio.sleep(PIPE_OPEN_POLL)
+    pipe = os.fdopen(fd, "wb", buffering=0)
+    # StreamReaderProtocol, unlike the bare FlowControlMixin, supports StreamWriter.wait_closed
+    transport, protocol = await loop.connect_write_pipe(
+        lambda: asyncio.StreamReaderProtocol(asyncio.StreamReader()), pipe
+    )
+    return asyncio.StreamWriter(transport, protocol, None, loop)
+
+
+async def StreamMergeVideo(
+    bot: Client,
+    messages: List[Message],
+    user_id: int,
+    message: Message,
+    format_: str
+) -> Optional[str]:
+    """
+    Merge queued videos by piping them from Telegram straight into FFmpeg.
+
+    Nothing but the output is written to disk. Returns None without side
+    effects on the queue when any clip cannot be read sequentially (MP4
+    with the index at the end) or the piped merge fails, so the caller can
+    download the clips and merge them normally.
+
+    Args:
+        bot: Pyrogram Client instance.
+        messages: Queued messages, in merge order.
+        user_id: Telegram User ID.
+        message: Pyrogram Message object to update progress.
+        format_: Output file extension.
+
+    Returns:
+        Path to the merged video file or None.
+    """
+    if not hasattr(os, "mkfifo"):
+        return None
+    user_dir = f"{Config.DOWN_PATH}/{user_id}"
+    pipes_dir = os.path.join(user_dir, "pipes")
+    os.makedirs(pipes_dir, exist_ok=True)
+    ext = format_.lower()
+
+    video_infos = []
+    pipe_paths = []
+    try:
+        for index, msg in enumerate(messages):
+            video_info = await probe_stream_head(bot, msg, os.path.join(pipes_dir, f"head_{index}.{ext}"))
+            if video_info is None:
+                return None
+            video_infos.append(video_info)
+            pipe_path = os.path.join(pipes_dir, f"{index}.{ext}")
+            if os.path.exists(pipe_path):
+                os.remove(pipe_path)
+            os.mkfifo(pipe_path)
+            pipe_paths.append(pipe_path)
+    except Exception as e:
+        logger.error(f"Failed to prepare streamed merge: {e}")
+        return None
+
+    input_path = os.path.join(user_dir, "input.txt")
+    with open(input_path, "w") as f:
+        f.write("\n".join(f"file '{os.path.abspath(path)}'" for path in pipe_paths))
+
+    async def feed() -> None:
+        for msg, pipe_path in zip(messages, pipe_paths):
+            writer = await _open_pipe_writer(pipe_path)
+            try:
+                async for chunk in bot.stream_media(msg):
+                    writer.write(chunk)
+                    await writer.drain()
+            finally:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+    projected_size = sum((msg.video or msg.document).file_size or 0 for msg in messages)
+    return await MergePipedVideo(
+        input_file=input_path,
+        video_infos=video_infos,
+        projected_size=projected_size,
+        feed=feed,
+        user_id=user_id,
+        message=message,
+        format_=format_
+    )
@@ -0,0 +1,158 @@
+# (c) @Savior_128
+
+import os
+import time
+import random
+import shutil
+import asyncio
+import hashlib
+import logging
+from typing import Optional
+from PIL import Image
+from configs import Config
+from pyrogram import Client
+from pyrogram.types import Message
+from helpers.database.access_db import db
+from helpers.ffmpeg import generate_thumbnail
+from helpers.scheduler import PRIORITY_NORMAL
+
+logger = logging.getLogger(__name__)
+
+# Telegram ignores video thumbnails larger than 320px on either side
+THUMB_MAX_SIDE = 320
+THUMB_CACHE_DIR = os.path.join(Config.CACHE_PATH, "thumbs")
+# Cached custom thumbnails kept; the least recently used ones are removed first
+THUMB_CACHE_ENTRIES = 1000
+
+
+def fit_thumbnail(source: str, output_file: str) -> str:
+    """
+    Save an image as a JPEG that fits Telegram's thumbnail limits.
+
+    Images that already are JPEGs within THUMB_MAX_SIDE are only copied.
+
+    Args:
+        source: Path to the input image.
+        output_file: Path of the JPEG to write (may equal source).
+
+    Returns:
+        str: output_file.
+    """
+    with Image.open(source) as img:
+        if img.format == "JPEG" and max(img.size) <= THUMB_MAX_SIDE:
+            if source != output_file:
+                shutil.copyfile(source, output_file)
+            return output_file
+        img = img.convert("RGB")
+        img.thumbnail((THUMB_MAX_SIDE, THUMB_MAX_SIDE))
+        img.save(output_file, "JPEG", quality=90)
+    return output_file
+
+
+def _prune_cache() -> None:
+    entries = []
+    for name in os.listdir(THUMB_CACHE_DIR):
+        path = os.path.join(THUMB_CACHE_DIR, name)
+        try:
+            entries.append((os.path.getmtime(path), path))
+        except OSError:
+            continue
+    entries.sort()
+    for _, path in entries[:max(0, len(entries) - THUMB_CACHE_ENTRIES)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+async def cached_custom_thumbnail(bot: Client, file_id: str) -> Optional[str]:
+    """
+    Get a user's custom thumbnail from the local cache, downloading it once.
+
+    Args:
+        bot: Pyrogram Client instance.
+        file_id: Telegram file_id of the thumbnail photo.
+
+    Returns:
+        Path to the cached JPEG or None if the download failed.
+    """
+    os.makedirs(THUMB_CACHE_DIR, exist_ok=True)
+    cached_path = os.path.join(THUMB_CACHE_DIR, f"{hashlib.sha1(file_id.encode()).hexdigest()}.jpg")
+    if os.path.exists(cached_path):
+        os.utime(cached_path)
+        return cached_path
+    try:
+        downloaded = await bot.download_media(
+            message=file_id,
+            file_name=f"{cached_path}.{time.time()}.part"
+        )
+        await asyncio.to_thread(fit_thumbnail, downloaded, cached_path)
+        os.remove(downloaded)
+    except Exception as e:
+        logger.error(f"Failed to cache custom thumbnail: {e}")
+        return None
+    await asyncio.to_thread(_prune_cache)
+    return cached_path
+
+
+async def _message_thumbnail(bot: Client, msg: Message, output_dir: str) -> Optional[str]:
+    """Download the thumbnail Telegram already made for a queued video, if any."""
+    media = msg.video or msg.document
+    thumbs = [thumb for thumb in (getattr(media, "thumbs", None) or []) if thumb.file_id]
+    if not thumbs:
+        return None
+    thumb = max(thumbs, key=lambda t: (t.width or 0) * (t.height or 0))
+    try:
+        downloaded = await bot.download_media(
+            message=thumb.file_id,
+            file_name=os.path.join(output_dir, "thumbnail", f"{msg.id}.jpg")
+        )
+        return await asyncio.to_thread(fit_thumbnail, downloaded, downloaded)
+    except Exception as e:
+        logger.error(f"Failed to download thumbnail of message {msg.id}: {e}")
+        return None
+
+
+async def prepare_thumbnail(
+    bot: Client,
+    user_id: int,
+    video_file: str,
+    duration: int,
+    first_message: Optional[Message] = None,
+    priority: int = PRIORITY_NORMAL
+) -> Optional[str]:
+    """
+    Get a Telegram-sized thumbnail for a merged video, doing as little work as possible.
+
+    Tried in order: the user's custom thumbnail (cached by file_id), the
+    thumbnail Telegram already has for the first queued video, and finally
+    a frame grabbed from the merged video.
+
+    Args:
+        bot: Pyrogram Client instance.
+        user_id: Telegram User ID.
+        video_file: Path to the merged video.
+        duration: Duration of the merged video in seconds.
+        first_message: First queued message, if available.
+        priority: Scheduling priority of the FFmpeg fallback.
+
+    Returns:
+        Path to a JPEG of at most THUMB_MAX_SIDE pixels per side, or None.
+    """
+    output_dir = f"{Config.DOWN_PATH}/{user_id}"
+    db_thumbnail = await db.get_thumbnail(user_id)
+    if db_thumbnail:
+        video_thumbnail = await cached_custom_thumbnail(bot, db_thumbnail)
+        if video_thumbnail:
+            return video_thumbnail
+    if first_message is not None:
+        video_thumbnail = await _message_thumbnail(bot, first_message, output_dir)
+        if video_thumbnail:
+            return video_thumbnail
+    return await generate_thumbnail(
+        video_file=video_file,
+        output_file=os.path.join(output_dir, f"{time.time()}.jpg"),
+        seek=random.randint(0, max(0, duration - 1)),
+        priority=priority,
+        max_side=THUMB_MAX_SIDE
+    )
@@ -9,7 +9,7 @@ from helpers.database.access_db import db
 from helpers.display_progress import progress_for_pyrogram, humanbytes
 from humanfriendly import format_timespan
 from pyrogram import Client
-from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Message
 from pyrogram.errors import MessageNotModified
 from pyrogram.enums import ParseMode
 
@@ -22,7 +22,7 @@ async def UploadVideo(
     duration: int,
     video_thumbnail: str | None,
     file_size: int
-) -> None:
+) -> Message | None:
     """
     Upload a merged video to Telegram as a video or document based on user settings.
 
@@ -35,7 +35,11 @@ async def UploadVideo(
         duration (int): Video duration in seconds.
         video_thumbnail (str | None): Path to the thumbnail file, or None if not available.
         file_size (int): Size of the video file in bytes.
+
+    Returns:
+        Message | None: The sent message, or None if the upload failed.
     """
+    sent_ = None
     try:
         # Check if the video file exists
         if not os.path.exists(merged_vid_path):
@@ -46,9 +50,8 @@ async def UploadVideo(
                 )
             except MessageNotModified:
                 pass
-            return
+            return None
 
-        sent_ = None
         caption = (
             Config.CAPTION.format((await bot.get_me()).username) +
             f"\n\n**File Name:** `{merged_vid_path.rsplit('/', 1)[-1]}`\n"
@@ -66,6 +69,7 @@ async def UploadVideo(
                 height=height,
                 duration=duration,
                 thumb=video_thumbnail,
+                supports_streaming=True,
                 caption=caption,
                 progress=progress_for_pyrogram,
                 progress_args=(
@@ -129,4 +133,4 @@ async def UploadVideo(
             )
         except MessageNotModified:
             pass
-            
+    return sent_
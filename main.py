@@ -5,12 +5,13 @@
 import os
 import time
 import string
+import hashlib
 import shutil
 import psutil
-import random
+import signal
 import asyncio
 import logging
-from PIL import Image
+from typing import Optional
 from configs import Config
 from pyromod import listen
 from pyrogram import Client, filters
@@ -27,11 +28,20 @@ from helpers.database.add_user import AddUserToDatabase
 from helpers.uploader import UploadVideo
 from helpers.settings import OpenSettings
 from helpers.forcesub import ForceSub
-from hachoir.parser import createParser
-from hachoir.metadata import extractMetadata
-from helpers.display_progress import progress_for_pyrogram, humanbytes
+from helpers.display_progress import progress_for_pyrogram, humanbytes, CombinedProgress
 from helpers.broadcast import broadcast_handler
-from helpers.ffmpeg import MergeVideo, generate_screen_shots, cult_small_video
+from helpers.ffmpeg import (
+    MergeVideo, ClipNormalizer, generate_screen_shots, cult_small_video,
+    get_video_info, get_media_metadata, exceeds_telegram_limit
+)
+from helpers.scheduler import scheduler, job_priority
+from helpers.streaming import StreamMergeVideo
+from helpers.thumbnail import prepare_thumbnail
+from helpers.download_cache import download_cache
+from helpers.disk_ledger import disk_ledger, estimate_merge_bytes
+from helpers.janitor import janitor
+from helpers.probe_cache import probe_cache
+from helpers.job_store import job_store, STAGE_MERGED
 
 # Configure logging
 logging.basicConfig(
@@ -47,14 +57,20 @@ except ImportError as e:
     logger.error(f"Failed to import utils: {e}")
     raise
 
-# Initialize in-memory databases
+# Initialize in-memory databases, restoring queues saved before the last shutdown
 QueueDB = {}
 ReplyDB = {}
 FormtDB = {}
-
-# Remove old session file
+MergeKeyDB = {}
+job_store.attach(QueueDB, FormtDB, ReplyDB)
+# Users whose merge is running right now, and tasks that must not be garbage collected
+RunningMerges = set()
+BackgroundTasks = set()
+janitor.attach(RunningMerges)
+
+# Remove old session file, unless interrupted jobs need its peer cache to reach their users
 session_file = f"{Config.SESSION_NAME}.session"
-if os.path.exists(session_file):
+if os.path.exists(session_file) and not job_store.jobs:
     os.remove(session_file)
     logger.info("Old session file deleted.")
 
@@ -69,13 +85,385 @@ NubBot = Client(
     name=Config.SESSION_NAME,
     api_id=int(Config.API_ID),
     api_hash=Config.API_HASH,
-    bot_token=Config.BOT_TOKEN
+    bot_token=Config.BOT_TOKEN,
+    max_concurrent_transmissions=Config.DOWNLOAD_CONCURRENCY
 )
 
 async def handle_flood_wait(e: FloodWait) -> None:
     """Handle FloodWait exceptions by waiting the required time."""
     await asyncio.sleep(e.value)
 
+def clip_length(msg: Message) -> tuple:
+    """Sort key ranking queued clips by Telegram-reported duration, then size."""
+    media = msg.video or msg.document
+    return getattr(media, "duration", None) or 0, media.file_size or 0
+
+def clip_profile(msg: Message) -> tuple:
+    """Telegram-reported resolution and MIME type, a cheap stand-in for the stream profile."""
+    media = msg.video or msg.document
+    return getattr(media, "width", None), getattr(media, "height", None), media.mime_type
+
+def unique_clips(messages: list) -> list:
+    """Drop queued messages carrying media already queued earlier, by file_unique_id."""
+    seen = set()
+    unique = []
+    for msg in messages:
+        file_unique_id = (msg.video or msg.document).file_unique_id
+        if file_unique_id not in seen:
+            seen.add(file_unique_id)
+            unique.append(msg)
+    return unique
+
+async def merge_result_key(user_id: int, messages: list) -> Optional[str]:
+    """
+    Key of a merge in the merge result cache.
+
+    The key covers the ordered inputs and every setting that changes the
+    uploaded result. Users who get screenshots or a sample need the merged
+    file itself, so their merges are not looked up (None).
+
+    Args:
+        user_id: Telegram User ID.
+        messages: Queued messages, in merge order.
+
+    Returns:
+        str: Hex digest key, or None if the merge cannot be served from the cache.
+    """
+    settings = await db.get_settings(user_id)
+    if settings["generate_ss"] or settings["generate_sample_video"]:
+        return None
+    parts = [(msg.video or msg.document).file_unique_id for msg in messages]
+    parts += [
+        FormtDB.get(user_id, "mkv").lower(),
+        Config.OUTPUT_PROFILE,
+        str(Config.FIT_TO_TELEGRAM),
+        str(settings["upload_as_doc"]),
+        str(settings["thumbnail"])
+    ]
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()
+
+# Attempts at re-sending a cached merge when Telegram answers with FloodWait
+SEND_CACHED_ATTEMPTS = 3
+
+async def send_merge_result(bot: Client, user_id: int, key: str) -> bool:
+    """
+    Re-send a previously uploaded merge by file_id, if there is one.
+
+    Args:
+        bot: Pyrogram Client instance.
+        user_id: Telegram User ID.
+        key: Merge result cache key.
+
+    Returns:
+        bool: True if the cached result was sent.
+    """
+    file_id = await db.get_merge_result(key)
+    if not file_id:
+        return False
+    for _ in range(SEND_CACHED_ATTEMPTS):
+        try:
+            await bot.send_cached_media(
+                chat_id=user_id,
+                file_id=file_id,
+                caption=Config.CAPTION.format((await bot.get_me()).username)
+            )
+            return True
+        except FloodWait as e:
+            await handle_flood_wait(e)
+        except Exception as e:
+            logger.warning(f"Cached merge {key} could not be sent, merging again: {e}")
+            await db.delete_merge_result(key)
+            return False
+    # The file_id is still valid, only Telegram kept refusing; keep it for next time
+    logger.warning(f"Cached merge {key} not sent after {SEND_CACHED_ATTEMPTS} FloodWaits, merging again")
+    return False
+
+async def download_and_merge(bot: Client, message: Message, user_id: int, messages: list) -> Optional[str]:
+    """
+    Download the queued videos and merge them.
+
+    Failures are reported on the status message and, where the queue can
+    no longer be used, the user's files and queue are cleared.
+
+    Args:
+        bot: Pyrogram Client instance.
+        message: Status message to report progress on.
+        user_id: Telegram User ID.
+        messages: Queued messages, in merge order.
+
+    Returns:
+        Path to the merged video file or None.
+    """
+    input_path = f"{Config.DOWN_PATH}/{user_id}/input.txt"
+    # Clips are normalized to the reference profile while the next ones download,
+    # unless the merge will be re-encoded to fit Telegram anyway
+    normalizer = ClipNormalizer(
+        output_dir=f"{Config.DOWN_PATH}/{user_id}",
+        format_=FormtDB.get(user_id, "mkv"),
+        priority=job_priority(user_id)
+    )
+    prenormalize = not exceeds_telegram_limit(sum((msg.video or msg.document).file_size or 0 for msg in messages))
+    # Clips of the profile covering the most footage first, longest first, so the early
+    # reference is likely the one MergeVideo picks and the fewest seconds get re-encoded
+    covered = {}
+    for msg in messages:
+        covered[clip_profile(msg)] = covered.get(clip_profile(msg), 0) + clip_length(msg)[0]
+    download_order = sorted(messages, key=lambda msg: (covered[clip_profile(msg)], clip_length(msg)), reverse=True)
+    downloaded = {}
+    probed = {}
+    corrupt = []
+    held = []
+    semaphore = asyncio.Semaphore(Config.DOWNLOAD_CONCURRENCY)
+    combined = CombinedProgress(
+        "در حال دانلود ...",
+        message,
+        {msg.id: (msg.video or msg.document).file_size or 0 for msg in messages}
+    )
+    await message.edit_text(f"در حال دانلود {len(messages)} ویدیو ...")
+
+    def settle_reference() -> None:
+        # The reference is the first clip in download order that downloaded and probed fine
+        if normalizer.reference_info is not None:
+            return
+        for msg in download_order:
+            if msg.id not in probed:
+                return
+            if probed[msg.id] is not None:
+                normalizer.add(downloaded[msg.id], probed[msg.id], reference=True)
+                return
+
+    async def fetch(msg: Message) -> None:
+        media = msg.video or msg.document
+        transferred = []
+
+        async def download(file_name: str) -> str:
+            transferred.append(msg.id)
+            return await bot.download_media(
+                message=msg,
+                file_name=file_name,
+                progress=combined.update,
+                progress_args=(msg.id,)
+            )
+
+        async with semaphore:
+            try:
+                file_dl_path = await download_cache.fetch(
+                    media.file_unique_id,
+                    media.file_name.rsplit(".", 1)[-1].lower(),
+                    download
+                )
+                held.append(media.file_unique_id)
+                if transferred:
+                    disk_ledger.track(user_id, file_dl_path)
+                else:
+                    # Served from the cache or by another job's download
+                    combined.drop(msg.id)
+            except Exception as e:
+                logger.error(f"Download failed for file {media.file_name}: {e}")
+                QueueDB[user_id].remove(msg.id)
+                combined.drop(msg.id)
+                probed[msg.id] = None
+                settle_reference()
+                await message.edit_text(f"فایل `{media.file_name}` نادیده گرفته شد!")
+                return
+        video_info = await get_video_info(file_dl_path, file_unique_id=media.file_unique_id)
+        if not video_info:
+            logger.error(f"Metadata extraction failed for {file_dl_path}")
+            download_cache.discard(media.file_unique_id)
+            corrupt.append(msg.id)
+            for task in tasks:
+                if task is not asyncio.current_task():
+                    task.cancel()
+            return
+        downloaded[msg.id] = file_dl_path
+        probed[msg.id] = video_info
+        if prenormalize:
+            normalizer.add(file_dl_path, video_info)
+            settle_reference()
+
+    try:
+        tasks = [asyncio.create_task(fetch(msg)) for msg in download_order]
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if corrupt:
+            normalizer.cancel()
+            await delete_all(root=f"{Config.DOWN_PATH}/{user_id}/")
+            disk_ledger.release(user_id)
+            QueueDB[user_id] = []
+            FormtDB[user_id] = None
+            await message.edit_text("ویدیو خراب است!\nبعداً دوباره امتحان کنید.")
+            return None
+        vid_list = [f"file '{downloaded[msg.id]}'" for msg in messages if msg.id in downloaded]
+        if len(vid_list) < 2:
+            normalizer.cancel()
+            await message.edit_text("فقط یک ویدیو در صف وجود دارد!\nممکن است ویدیوی تکراری ارسال کرده باشید.")
+            return None
+        await message.edit_text("در حال ادغام ویدیوها ...")
+        with open(input_path, 'w') as f:
+            f.write("\n".join(vid_list))
+        merged_vid_path = await MergeVideo(
+            input_file=input_path,
+            user_id=user_id,
+            message=message,
+            format_=FormtDB.get(user_id, "mkv"),
+            normalizer=normalizer
+        )
+        normalizer.cancel()
+        if not merged_vid_path:
+            await message.edit_text("خطا در ادغام ویدیو!")
+            await delete_all(root=f"{Config.DOWN_PATH}/{user_id}/")
+            disk_ledger.release(user_id)
+            QueueDB[user_id] = []
+            FormtDB[user_id] = None
+            return None
+        return merged_vid_path
+    finally:
+        # Merged output exists or the job failed; cached clips may be evicted again
+        download_cache.release_all(held)
+
+async def run_merge(bot: Client, message: Message, user_id: int) -> None:
+    """
+    Merge a user's queue and offer the result for upload.
+
+    Runs for the merge button and for jobs resumed after a restart.
+
+    Args:
+        bot: Pyrogram Client instance.
+        message: Status message to report progress on.
+        user_id: Telegram User ID.
+    """
+    RunningMerges.add(user_id)
+    try:
+        messages = unique_clips(await bot.get_messages(chat_id=user_id, message_ids=sorted(QueueDB.get(user_id, []))))
+        if len(messages) < 2:
+            await message.edit_text("فقط یک ویدیو در صف وجود دارد!\nممکن است ویدیوی تکراری ارسال کرده باشید.")
+            return
+        merge_key = await merge_result_key(user_id, messages)
+        if merge_key and await send_merge_result(bot, user_id, merge_key):
+            await message.delete()
+            QueueDB[user_id] = []
+            FormtDB[user_id] = None
+            return
+        MergeKeyDB[user_id] = merge_key
+
+        async def wait_for_disk(shortfall: int) -> None:
+            try:
+                await message.edit_text(
+                    f"در انتظار آزاد شدن فضای دیسک ...\n`{humanbytes(shortfall)}` دیگر لازم است.",
+                    parse_mode=ParseMode.MARKDOWN
+                )
+            except MessageNotModified:
+                pass
+
+        async def reserve_disk(streamed: bool) -> bool:
+            download_bytes = sum(
+                (msg.video or msg.document).file_size or 0
+                for msg in messages
+                if (msg.video or msg.document).file_unique_id not in download_cache
+            )
+            if await disk_ledger.reserve(
+                user_id,
+                estimate_merge_bytes(messages, download_bytes, streamed=streamed),
+                [f"{Config.DOWN_PATH}/{user_id}"],
+                on_wait=wait_for_disk,
+                keep=[(msg.video or msg.document).file_unique_id for msg in messages]
+            ):
+                return True
+            await message.edit_text("فضای دیسک برای ادغام این ویدیوها کافی نیست!")
+            QueueDB[user_id] = []
+            FormtDB[user_id] = None
+            return False
+
+        if not await reserve_disk(streamed=Config.STREAM_INPUTS):
+            return
+        # Created only once the job holds a reservation, so the janitor leaves it alone
+        os.makedirs(f"{Config.DOWN_PATH}/{user_id}/", exist_ok=True)
+        job_store.start(user_id, message.chat.id, message.id)
+        await job_store.save()
+        merged_vid_path = None
+        if Config.STREAM_INPUTS:
+            await message.edit_text("در حال ادغام مستقیم ویدیوها از تلگرام ...")
+            merged_vid_path = await StreamMergeVideo(
+                bot=bot,
+                messages=messages,
+                user_id=user_id,
+                message=message,
+                format_=FormtDB.get(user_id, "mkv")
+            )
+            if merged_vid_path is None:
+                logger.info(f"Streamed merge not possible for user {user_id}, downloading instead")
+                # The streamed reservation left out the downloads and intermediates
+                if not await reserve_disk(streamed=False):
+                    job_store.finish(user_id)
+                    return
+        if merged_vid_path is None:
+            merged_vid_path = await download_and_merge(bot, message, user_id, messages)
+        if not merged_vid_path:
+            disk_ledger.release(user_id)
+            job_store.finish(user_id)
+            return
+        if not all(msg.id in QueueDB.get(user_id, []) for msg in messages):
+            # Some clips were skipped, so the result is not the merge the key describes
+            MergeKeyDB[user_id] = None
+        await message.edit_text("ویدیو با موفقیت ادغام شد!")
+        await asyncio.sleep(Config.TIME_GAP)
+        file_size = os.path.getsize(merged_vid_path)
+        if file_size > Config.TG_MAX_FILE_SIZE:
+            await message.edit_text(
+                f"حجم فایل {humanbytes(file_size)} است!\nنمی‌توان در تلگرام آپلود کرد!\nدر حال آپلود به Streamtape ..."
+            )
+            await UploadToStreamtape(file=merged_vid_path, editable=message, file_size=file_size)
+            await delete_all(root=f"{Config.DOWN_PATH}/{user_id}/")
+            disk_ledger.release(user_id)
+            QueueDB[user_id] = []
+            FormtDB[user_id] = None
+            return
+        job_store.set_stage(user_id, STAGE_MERGED, merged_vid_path)
+        await job_store.save()
+        await message.edit_text(
+            text="آیا می‌خواهید نام فایل را تغییر دهید؟",
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("بله", callback_data="renameFile_Yes")],
+                [InlineKeyboardButton("خیر", callback_data="renameFile_No")]
+            ])
+        )
+    finally:
+        RunningMerges.discard(user_id)
+
+async def resume_jobs(bot: Client) -> None:
+    """Pick up the merges that were interrupted by the last shutdown."""
+    for user_id, job in list(job_store.jobs.items()):
+        try:
+            message = await bot.get_messages(chat_id=job["chat_id"], message_ids=job["message_id"])
+            output = job.get("output")
+            if job["stage"] == STAGE_MERGED and output and os.path.exists(output):
+                # Merge finished before the restart; only the upload is left
+                await disk_ledger.reserve(user_id, 0, [f"{Config.DOWN_PATH}/{user_id}"])
+                await message.edit_text(
+                    text="ربات دوباره راه‌اندازی شد و ویدیوی ادغام‌شده آماده است.\nآیا می‌خواهید نام فایل را تغییر دهید؟",
+                    reply_markup=InlineKeyboardMarkup([
+                        [InlineKeyboardButton("بله", callback_data="renameFile_Yes")],
+                        [InlineKeyboardButton("خیر", callback_data="renameFile_No")]
+                    ])
+                )
+                continue
+            logger.info(f"Resuming merge of user {user_id}")
+            await message.edit_text("ربات دوباره راه‌اندازی شد، ادغام ادامه می‌یابد ...")
+        except Exception as e:
+            logger.warning(f"Cannot resume job of user {user_id}: {e}")
+            job_store.finish(user_id)
+            continue
+        task = asyncio.create_task(run_merge(bot, message, user_id))
+        BackgroundTasks.add(task)
+        task.add_done_callback(BackgroundTasks.discard)
+
+async def drain_merges(timeout: float) -> None:
+    """Wait up to `timeout` seconds for running merges to finish."""
+    deadline = time.time() + timeout
+    while RunningMerges and time.time() < deadline:
+        await asyncio.sleep(1)
+    if RunningMerges:
+        logger.info(f"Stopping with {len(RunningMerges)} merges running; they resume on the next start")
+
 async def get_channel_invite_link(bot: Client, channel_id: str) -> str:
     """Generate an invite link for the updates channel."""
     channel = int(channel_id) if channel_id.startswith("-100") else channel_id
@@ -152,7 +540,9 @@ async def status_handler(_, m: Message):
             f"**فضای آزاد:** {humanbytes(free)}\n"
             f"**استفاده از CPU:** {cpu_usage}%\n"
             f"**استفاده از RAM:** {ram_usage}%\n\n"
-            f"**تعداد کل کاربران در پایگاه داده:** `{total_users}`"
+            f"**تعداد کل کاربران در پایگاه داده:** `{total_users}`\n\n"
+            f"{scheduler.allocation_report()}\n\n"
+            f"{janitor.report()}"
         ),
         parse_mode=ParseMode.MARKDOWN,
         quote=True
@@ -223,11 +613,12 @@ async def check_handler(bot: Client, m: Message):
     editable = await m.reply_text("در حال بررسی اطلاعات کاربر ...")
     try:
         user = await bot.get_users(int(m.command[1]))
+        settings = await db.get_settings(user.id)
         detail_text = (
             f"**نام:** [{user.first_name}](tg://user?id={user.id})\n"
             f"**نام کاربری:** `{user.username or 'ندارد'}`\n"
-            f"**آپلود به‌صورت سند:** `{await db.get_upload_as_doc(user.id)}`\n"
-            f"**تولید تصاویر کوچک:** `{await db.get_generate_ss(user.id)}`\n"
+            f"**آپلود به‌صورت سند:** `{settings['upload_as_doc']}`\n"
+            f"**تولید تصاویر کوچک:** `{settings['generate_ss']}`\n"
         )
         await editable.edit_text(
             text=detail_text,
@@ -245,93 +636,17 @@ async def callback_handlers(bot: Client, cb: CallbackQuery):
 
     if data == "mergeNow":
         await cb.message.edit_text("لطفاً صبر کنید ...")
-        vid_list = []
-        duration = 0
         list_message_ids = QueueDB.get(user_id, [])
         if not list_message_ids:
             await cb.answer("صف خالی است!", show_alert=True)
             await cb.message.delete()
             return
         list_message_ids.sort()
-        input_path = f"{Config.DOWN_PATH}/{user_id}/input.txt"
         if len(list_message_ids) < 2:
             await cb.answer("حداقل دو ویدیو برای ادغام نیاز است!", show_alert=True)
             await cb.message.delete()
             return
-        os.makedirs(f"{Config.DOWN_PATH}/{user_id}/", exist_ok=True)
-        for msg in await bot.get_messages(chat_id=user_id, message_ids=list_message_ids):
-            media = msg.video or msg.document
-            try:
-                await cb.message.edit_text(f"در حال دانلود `{media.file_name}` ...")
-            except MessageNotModified:
-                QueueDB[user_id].remove(msg.id)
-                await cb.message.edit_text("فایل نادیده گرفته شد!")
-                await asyncio.sleep(3)
-                continue
-            try:
-                c_time = time.time()
-                file_dl_path = await bot.download_media(
-                    message=msg,
-                    file_name=f"{Config.DOWN_PATH}/{user_id}/{msg.id}/",
-                    progress=progress_for_pyrogram,
-                    progress_args=("در حال دانلود ...", cb.message, c_time)
-                )
-            except Exception as e:
-                logger.error(f"Download failed for file {media.file_name}: {e}")
-                QueueDB[user_id].remove(msg.id)
-                await cb.message.edit_text("فایل نادیده گرفته شد!")
-                await asyncio.sleep(3)
-                continue
-            try:
-                metadata = extractMetadata(createParser(file_dl_path))
-                if metadata and metadata.has("duration"):
-                    duration += metadata.get("duration").seconds
-                vid_list.append(f"file '{file_dl_path}'")
-            except Exception as e:
-                logger.error(f"Metadata extraction failed: {e}")
-                await delete_all(root=f"{Config.DOWN_PATH}/{user_id}/")
-                QueueDB[user_id] = []
-                FormtDB[user_id] = None
-                await cb.message.edit_text("ویدیو خراب است!\nبعداً دوباره امتحان کنید.")
-                return
-        vid_list = list(dict.fromkeys(vid_list))  # Remove duplicates
-        if len(vid_list) < 2:
-            await cb.message.edit_text("فقط یک ویدیو در صف وجود دارد!\nممکن است ویدیوی تکراری ارسال کرده باشید.")
-            return
-        await cb.message.edit_text("در حال ادغام ویدیوها ...")
-        with open(input_path, 'w') as f:
-            f.write("\n".join(vid_list))
-        merged_vid_path = await MergeVideo(
-            input_file=input_path,
-            user_id=user_id,
-            message=cb.message,
-            format_=FormtDB.get(user_id, "mkv")
-        )
-        if not merged_vid_path:
-            await cb.message.edit_text("خطا در ادغام ویدیو!")
-            await delete_all(root=f"{Config.DOWN_PATH}/{user_id}/")
-            QueueDB[user_id] = []
-            FormtDB[user_id] = None
-            return
-        await cb.message.edit_text("ویدیو با موفقیت ادغام شد!")
-        await asyncio.sleep(Config.TIME_GAP)
-        file_size = os.path.getsize(merged_vid_path)
-        if file_size > 2097152000:
-            await cb.message.edit_text(
-                f"حجم فایل {humanbytes(file_size)} است!\nنمی‌توان در تلگرام آپلود کرد!\nدر حال آپلود به Streamtape ..."
-            )
-            await UploadToStreamtape(file=merged_vid_path, editable=cb.message, file_size=file_size)
-            await delete_all(root=f"{Config.DOWN_PATH}/{user_id}/")
-            QueueDB[user_id] = []
-            FormtDB[user_id] = None
-            return
-        await cb.message.edit_text(
-            text="آیا می‌خواهید نام فایل را تغییر دهید؟",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("بله", callback_data="renameFile_Yes")],
-                [InlineKeyboardButton("خیر", callback_data="renameFile_No")]
-            ])
-        )
+        await run_merge(bot, cb.message, user_id)
 
     elif data == "refreshFsub" and Config.UPDATES_CHANNEL:
         try:
@@ -438,7 +753,7 @@ async def callback_handlers(bot: Client, cb: CallbackQuery):
         if not QueueDB.get(user_id, []):
             await cb.answer("صف شما خالی است!", show_alert=True)
             return
-        merged_vid_path = f"{Config.DOWN_PATH}/{user_id}/[@Savior_128]_Merged.{FormtDB.get(user_id, 'mkv').lower()}"
+        merged_vid_path = default_vid_path = f"{Config.DOWN_PATH}/{user_id}/[@Savior_128]_Merged.{FormtDB.get(user_id, 'mkv').lower()}"
         if data == "renameFile_Yes":
             await cb.message.edit_text("لطفاً نام جدید فایل را ارسال کنید!")
             try:
@@ -457,49 +772,34 @@ async def callback_handlers(bot: Client, cb: CallbackQuery):
                 logger.error(f"Error renaming file: {e}")
         await cb.message.edit_text("در حال استخراج اطلاعات ویدیو ...")
         duration, width, height = 1, 100, 100
-        try:
-            metadata = extractMetadata(createParser(merged_vid_path))
-            if metadata:
-                if metadata.has("duration"):
-                    duration = metadata.get("duration").seconds
-                if metadata.has("width"):
-                    width = metadata.get("width")
-                if metadata.has("height"):
-                    height = metadata.get("height")
-        except Exception as e:
-            logger.error(f"Metadata extraction failed: {e}")
+        merged_vid_info = await get_video_info(merged_vid_path)
+        if merged_vid_info:
+            probed_duration, probed_width, probed_height = get_media_metadata(merged_vid_info)
+            duration = probed_duration or duration
+            width = probed_width or width
+            height = probed_height or height
+        else:
+            logger.error(f"Metadata extraction failed for {merged_vid_path}")
             await delete_all(root=f"{Config.DOWN_PATH}/{user_id}/")
+            disk_ledger.release(user_id)
             QueueDB[user_id] = []
             FormtDB[user_id] = None
             await cb.message.edit_text("ویدیوی ادغام‌شده خراب است!\nبعداً دوباره امتحان کنید.")
             return
-        video_thumbnail = None
-        db_thumbnail = await db.get_thumbnail(user_id)
-        if db_thumbnail:
-            video_thumbnail = await bot.download_media(
-                message=db_thumbnail,
-                file_name=f"{Config.DOWN_PATH}/{user_id}/thumbnail/"
-            )
-            with Image.open(video_thumbnail).convert("RGB") as img:
-                img.resize((width, height)).save(video_thumbnail, "JPEG")
-        else:
-            video_thumbnail = f"{Config.DOWN_PATH}/{user_id}/{time.time()}.jpg"
-            ttl = random.randint(0, duration - 1)
-            file_generator_command = [
-                "ffmpeg", "-ss", str(ttl), "-i", merged_vid_path, "-vframes", "1", video_thumbnail
-            ]
-            process = await asyncio.create_subprocess_exec(
-                *file_generator_command,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await process.communicate()
-            if os.path.exists(video_thumbnail):
-                with Image.open(video_thumbnail).convert("RGB") as img:
-                    img.resize((width, height)).save(video_thumbnail, "JPEG")
-            else:
-                video_thumbnail = None
-        await UploadVideo(
+        try:
+            first_message = await bot.get_messages(chat_id=user_id, message_ids=QueueDB[user_id][0])
+        except Exception as e:
+            logger.warning(f"Failed to fetch first queued message: {e}")
+            first_message = None
+        video_thumbnail = await prepare_thumbnail(
+            bot=bot,
+            user_id=user_id,
+            video_file=merged_vid_path,
+            duration=duration,
+            first_message=first_message,
+            priority=job_priority(user_id)
+        )
+        sent_ = await UploadVideo(
             bot=bot,
             cb=cb,
             merged_vid_path=merged_vid_path,
@@ -509,11 +809,16 @@ async def callback_handlers(bot: Client, cb: CallbackQuery):
             video_thumbnail=video_thumbnail,
             file_size=os.path.getsize(merged_vid_path)
         )
+        merge_key = MergeKeyDB.pop(user_id, None)
+        # Renamed results are personal, only default-named uploads are reused
+        if sent_ and merge_key and merged_vid_path == default_vid_path:
+            await db.set_merge_result(merge_key, (sent_.video or sent_.document).file_id)
         caption = f"© @{(await bot.get_me()).username}"
-        if await db.get_generate_ss(user_id):
+        settings = await db.get_settings(user_id)
+        if settings["generate_ss"]:
             await cb.message.edit_text("در حال تولید تصاویر کوچک ...")
             generate_ss_dir = f"{Config.DOWN_PATH}/{user_id}"
-            list_images = await generate_screen_shots(merged_vid_path, generate_ss_dir, 9, duration)
+            list_images = await generate_screen_shots(merged_vid_path, generate_ss_dir, 9, duration, merged_vid_info, job_priority(user_id))
             if not list_images:
                 await cb.message.edit_text("خطا در تولید تصاویر کوچک!")
                 await asyncio.sleep(Config.TIME_GAP)
@@ -526,7 +831,7 @@ async def callback_handlers(bot: Client, cb: CallbackQuery):
                 ]
                 if photo_album:
                     await bot.send_media_group(chat_id=user_id, media=photo_album)
-        if await db.get_generate_sample_video(user_id) and duration >= 15:
+        if settings["generate_sample_video"] and duration >= 15:
             await cb.message.edit_text("در حال تولید ویدیوی نمونه ...")
             sample_vid_dir = f"{Config.DOWN_PATH}/{user_id}/"
             ttl = int(duration * 10 / 100)
@@ -535,7 +840,10 @@ async def callback_handlers(bot: Client, cb: CallbackQuery):
                 output_directory=sample_vid_dir,
                 start_time=ttl,
                 end_time=ttl + 10,
-                format_=FormtDB.get(user_id)
+                format_=FormtDB.get(user_id),
+                message=cb.message,
+                video_info=merged_vid_info,
+                priority=job_priority(user_id)
             )
             if not sample_video:
                 await cb.message.edit_text("خطا در تولید ویدیوی نمونه!")
@@ -543,17 +851,14 @@ async def callback_handlers(bot: Client, cb: CallbackQuery):
             else:
                 await cb.message.edit_text("ویدیوی نمونه با موفقیت تولید شد!\nدر حال آپلود ...")
                 sam_vid_duration, sam_vid_width, sam_vid_height = 5, 100, 100
-                try:
-                    metadata = extractMetadata(createParser(sample_video))
-                    if metadata:
-                        if metadata.has("duration"):
-                            sam_vid_duration = metadata.get("duration").seconds
-                        if metadata.has("width"):
-                            sam_vid_width = metadata.get("width")
-                        if metadata.has("height"):
-                            sam_vid_height = metadata.get("height")
-                except Exception as e:
-                    logger.error(f"Sample video metadata extraction failed: {e}")
+                sample_info = await get_video_info(sample_video, cache=False)
+                if sample_info:
+                    probed_duration, probed_width, probed_height = get_media_metadata(sample_info)
+                    sam_vid_duration = probed_duration or sam_vid_duration
+                    sam_vid_width = probed_width or sam_vid_width
+                    sam_vid_height = probed_height or sam_vid_height
+                else:
+                    logger.error(f"Sample video metadata extraction failed for {sample_video}")
                     await cb.message.edit_text("فایل ویدیوی نمونه خراب است!")
                     await asyncio.sleep(Config.TIME_GAP)
                 try:
@@ -565,6 +870,7 @@ async def callback_handlers(bot: Client, cb: CallbackQuery):
                         width=sam_vid_width,
                         height=sam_vid_height,
                         duration=sam_vid_duration,
+                        supports_streaming=True,
                         caption=caption,
                         progress=progress_for_pyrogram,
                         progress_args=("در حال آپلود ویدیوی نمونه ...", cb.message, c_time)
@@ -575,6 +881,7 @@ async def callback_handlers(bot: Client, cb: CallbackQuery):
                     await asyncio.sleep(Config.TIME_GAP)
         await cb.message.delete()
         await delete_all(root=f"{Config.DOWN_PATH}/{user_id}/")
+        disk_ledger.release(user_id)
         QueueDB[user_id] = []
         FormtDB[user_id] = None
 
@@ -585,13 +892,37 @@ async def callback_handlers(bot: Client, cb: CallbackQuery):
 
 async def main():
     """Main function to start the bot."""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass  # Not supported on Windows
+    janitor_task = None
+    checkpoint_task = None
+    probe_cache_task = None
     try:
+        await db.ensure_indexes()
+        await db.warm_known_users()
         await NubBot.start()
         logger.info("Bot started successfully!")
-        await asyncio.Event().wait()  # Keep bot running
+        janitor_task = asyncio.create_task(janitor.run())
+        checkpoint_task = asyncio.create_task(job_store.run())
+        probe_cache_task = asyncio.create_task(probe_cache.run())
+        await resume_jobs(NubBot)
+        await stop_event.wait()  # Keep bot running until SIGTERM/SIGINT
+        logger.info("Shutdown requested, draining running merges ...")
+        await drain_merges(Config.DRAIN_TIMEOUT)
     except Exception as e:
         logger.error(f"Bot failed to start: {e}")
     finally:
+        for task in (janitor_task, checkpoint_task, probe_cache_task):
+            if task is not None:
+                task.cancel()
+        await job_store.save()
+        await probe_cache.save()
+        await db.flush()
         await NubBot.stop()
 
 if __name__ == "__main__":
@@ -0,0 +1,61 @@
+# (c) @Savior_128
+
+import os
+import asyncio
+import pytest
+
+pytest.importorskip("pyrogram")
+
+from helpers import ffmpeg
+from helpers.streaming import _open_pipe_writer
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="needs named pipes")
+
+
+async def _write_through_fifo(pipe_path: str, output_path: str, chunks) -> None:
+    reader = await asyncio.create_subprocess_exec("sh", "-c", f"cat '{pipe_path}' > '{output_path}'")
+    writer = await _open_pipe_writer(pipe_path)
+    try:
+        for chunk in chunks:
+            writer.write(chunk)
+            await writer.drain()
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    assert await asyncio.wait_for(reader.wait(), 10) == 0
+
+
+def test_fifo_round_trip(tmp_path):
+    pipe_path = str(tmp_path / "0.mp4")
+    output_path = str(tmp_path / "out.bin")
+    os.mkfifo(pipe_path)
+    chunks = [bytes([i]) * (1024 * 1024) for i in range(4)]
+    asyncio.run(_write_through_fifo(pipe_path, output_path, chunks))
+    with open(output_path, "rb") as f:
+        assert f.read() == b"".join(chunks)
+
+
+def test_piped_merge_returns_when_ffmpeg_exits_first(tmp_path, monkeypatch):
+    async def failed_ffmpeg(*args, **kwargs):
+        return 1, "boom"
+
+    async def stuck_feed():
+        # Stands in for a feeder waiting on a pipe FFmpeg will never open
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(ffmpeg, "_run_ffmpeg", failed_ffmpeg)
+    monkeypatch.setattr(ffmpeg.Config, "DOWN_PATH", str(tmp_path))
+    video_info = {
+        "format": {"duration": "10"},
+        "streams": [{"codec_type": "video", "codec_name": "h264", "width": 640, "height": 360, "r_frame_rate": "25/1"}]
+    }
+    result = asyncio.run(asyncio.wait_for(ffmpeg.MergePipedVideo(
+        input_file=str(tmp_path / "input.txt"),
+        video_infos=[video_info, video_info],
+        projected_size=0,
+        feed=stuck_feed,
+        user_id=1,
+        message=None,
+        format_="mp4"
+    ), 5))
+    assert result is None